@@ -0,0 +1,251 @@
+"""
+Offline benchmarks for the economy and rendering hot paths of gcbot.py.
+
+Generates synthetic shops and player files in a temp directory, then times:
+  - buy:      the full purchase transaction (stock check, debit, journal commit)
+  - wallet:   building the /wallet text
+  - wallethit: /wallet for a wallet that is already in the render cache
+  - lookup:   catalog lookup of an item ID
+  - render:   rendering a whole shop into message chunks
+  - snapshot: a full snapshot of players.json (what compaction costs)
+
+Reports ops/sec, p50/p99 latency and bytes written to disk per operation.
+
+    python bench.py
+    python bench.py --items 500 --players 5000 --inventory 200 --backend sqlite --out bench_output.txt
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict
+
+import gcbot
+
+
+# ---------------------------
+# SYNTHETIC DATA
+# ---------------------------
+
+ROLE_IDS = [1000000000000000000 + i for i in range(8)]
+
+def make_shop(prefix: str, n_items: int, rng: random.Random) -> Dict[str, Any]:
+    items = {}
+    for i in range(n_items):
+        role_stock = None
+        if i % 5 == 0:
+            # every fifth item is tribe-limited
+            role_stock = {str(r): rng.choice(["-", str(rng.randint(50, 500))]) for r in ROLE_IDS}
+        items[f"{prefix}-item-{i}"] = {
+            "name": f"{prefix.title()} Item {i}",
+            "description": "Synthetic benchmark item. " * rng.randint(1, 4),
+            "price": rng.randint(1, 50),
+            "stock": rng.choice(["-", str(rng.randint(1000, 100000))]),
+            "public_stock": rng.choice(["y", "n"]),
+            "role_stock": role_stock
+        }
+    return {"channel_id": 0, "title": prefix.title(), "items": items}
+
+def make_players(n_players: int, inventory: int, item_ids: list[str], rng: random.Random) -> Dict[str, Any]:
+    players = {}
+    for i in range(n_players):
+        uid = str(2000000000000000000 + i)
+        items: Dict[str, int] = {}
+        for _ in range(inventory):
+            item_id = rng.choice(item_ids)
+            items[item_id] = items.get(item_id, 0) + 1
+        players[uid] = {
+            "name": f"player-{i}",
+            "money": 10 ** 9,  # never runs out during the benchmark
+            "items": items
+        }
+    return players
+
+
+class FakeRole:
+    def __init__(self, role_id: int):
+        self.id = role_id
+
+    def is_default(self) -> bool:
+        return False
+
+
+class FakeMember:
+    """Just enough of discord.Member for the economy code."""
+
+    def __init__(self, uid: str, rng: random.Random):
+        self.id = int(uid)
+        self.display_name = f"player-{uid[-4:]}"
+        self.mention = f"<@{uid}>"
+        self.roles = [FakeRole(rng.choice(ROLE_IDS))]
+
+
+# ---------------------------
+# MEASURING
+# ---------------------------
+
+def bytes_written() -> int | None:
+    """Bytes this process has written so far (Linux only)."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def summarize(name: str, timings: list[float], written: int | None) -> Dict[str, Any]:
+    timings = sorted(timings)
+    total = sum(timings)
+    p99_index = min(len(timings) - 1, int(len(timings) * 0.99))
+    return {
+        "name": name,
+        "ops": len(timings),
+        "ops_per_sec": len(timings) / total if total else float("inf"),
+        "p50_ms": statistics.median(timings) * 1000,
+        "p99_ms": timings[p99_index] * 1000,
+        "bytes_per_op": (written / len(timings)) if written is not None else None
+    }
+
+def run_sync(name: str, ops: int, fn: Callable[[int], Any]) -> Dict[str, Any]:
+    timings = []
+    before = bytes_written()
+    for i in range(ops):
+        start = time.perf_counter()
+        fn(i)
+        timings.append(time.perf_counter() - start)
+    after = bytes_written()
+    written = after - before if before is not None and after is not None else None
+    return summarize(name, timings, written)
+
+async def run_async(name: str, ops: int, fn: Callable[[int], Any]) -> Dict[str, Any]:
+    timings = []
+    before = bytes_written()
+    for i in range(ops):
+        start = time.perf_counter()
+        await fn(i)
+        timings.append(time.perf_counter() - start)
+    after = bytes_written()
+    written = after - before if before is not None and after is not None else None
+    return summarize(name, timings, written)
+
+def format_results(results: list[Dict[str, Any]], args: argparse.Namespace) -> str:
+    lines = [
+        f"backend={args.backend} items={args.items}/shop players={args.players} "
+        f"inventory={args.inventory} ops={args.ops}",
+        f"{'benchmark':<10} {'ops/sec':>12} {'p50 ms':>10} {'p99 ms':>10} {'bytes/op':>12}",
+    ]
+    for r in results:
+        bytes_op = f"{r['bytes_per_op']:.0f}" if r["bytes_per_op"] is not None else "n/a"
+        lines.append(
+            f"{r['name']:<10} {r['ops_per_sec']:>12.1f} {r['p50_ms']:>10.3f} "
+            f"{r['p99_ms']:>10.3f} {bytes_op:>12}"
+        )
+    return "\n".join(lines)
+
+
+# ---------------------------
+# BENCHMARKS
+# ---------------------------
+
+async def run_benchmarks(args: argparse.Namespace) -> list[Dict[str, Any]]:
+    rng = random.Random(args.seed)
+
+    kauf = make_shop("kaufhaus", args.items, rng)
+    schwar = make_shop("schwarz", args.items, rng)
+    item_ids = list(kauf["items"]) + list(schwar["items"])
+    players = make_players(args.players, args.inventory, item_ids, rng)
+
+    for path, data in (
+        (gcbot.KAUFHAUS_FILE, kauf),
+        (gcbot.SCHWARTZ_FILE, schwar),
+        (gcbot.PLAYERS_FILE, players),
+    ):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    gcbot.JOURNAL_GROUP_DELAY = args.group_delay
+    if args.backend == "sqlite":
+        gcbot.storage = gcbot.SqliteBackend(gcbot.SQLITE_FILE)
+    else:
+        gcbot.storage = gcbot.JsonBackend(gcbot.JOURNAL_FILE)
+    gcbot.init_shop_files()
+
+    uids = list(players)
+    members = {uid: FakeMember(uid, rng) for uid in rng.sample(uids, min(len(uids), 200))}
+    member_list = list(members.values())
+    buyable = [
+        item_id for item_id in item_ids
+        if gcbot.find_item_in_shops(item_id)[1].get("role_stock") is None
+    ]
+
+    results = []
+
+    async def buy(i: int):
+        await gcbot.purchase_item(member_list[i % len(member_list)], buyable[i % len(buyable)])
+    results.append(await run_async("buy", args.ops, buy))
+
+    def wallet(i: int):
+        # past the render cache, that's what a changed wallet costs
+        gcbot.build_wallet_message(member_list[i % len(member_list)])
+    results.append(run_sync("wallet", args.ops, wallet))
+
+    for member in member_list:
+        gcbot.format_wallet_message(member)
+
+    def wallet_hit(i: int):
+        gcbot.format_wallet_message(member_list[i % len(member_list)])
+    results.append(run_sync("wallethit", args.ops, wallet_hit))
+
+    def lookup(i: int):
+        gcbot.find_item_in_shops(item_ids[i % len(item_ids)])
+    results.append(run_sync("lookup", args.ops * 10, lookup))
+
+    def render(i: int):
+        gcbot.build_shop_chunks(gcbot.kaufhaus_store.data, gcbot.kaufhaus_store.label)
+    results.append(run_sync("render", max(1, args.ops // 10), render))
+
+    def snapshot(i: int):
+        gcbot.player_store.mark_dirty()
+        gcbot.flush_all()
+    results.append(run_sync("snapshot", max(1, args.ops // 100), snapshot))
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=300, help="items per shop")
+    parser.add_argument("--players", type=int, default=2000, help="wallets in players.json")
+    parser.add_argument("--inventory", type=int, default=100, help="purchases already in each inventory")
+    parser.add_argument("--ops", type=int, default=1000, help="operations per benchmark")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--group-delay", type=float, default=0.0,
+                        help="JOURNAL_GROUP_DELAY during the run (0 measures pure cost)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="also write the report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="gcbot-bench-") as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            results = asyncio.run(run_benchmarks(args))
+        finally:
+            os.chdir(cwd)
+
+    report = format_results(results, args)
+    print(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,840 +1,3385 @@
-import discord
-from discord import app_commands
-from discord.ext import commands
-import re
-import asyncio
-import os
-import json
-from typing import Dict, Any, Tuple
-
-# ---------------------------
-# CONFIG / INTENTS
-# ---------------------------
-
-intents = discord.Intents.default()
-intents.guilds = True
-intents.members = True
-intents.message_content = True  # <- we need this now to read !buy
-BOT_TOKEN = "BOT_TOKEN"  # rotate your old token and paste new one here
-
-KAUFHAUS_FILE = "kaufhaus.json"
-SCHWARTZ_FILE = "schwartzmarkt.json"
-PLAYERS_FILE = "players.json"
-
-HOST_PING = "<@&1427964239443656764>"  # change to your staff/host role mention for the ||@hosts|| part
-HOST_ROLE_ID = 1427964239443656764  # change this to the same thing, but just the numebrs
-
-
-# ---------------------------
-# BASIC HELPERS
-# ---------------------------
-
-def sanitize_channel_name(name: str) -> str:
-    clean = name.lower()
-    clean = clean.replace(" ", "-").replace("_", "-")
-    clean = re.sub(r"[^a-z0-9\-]", "", clean)
-    clean = re.sub(r"-{2,}", "-", clean)
-    clean = clean.strip("-")
-    if len(clean) == 0:
-        clean = "player"
-    if len(clean) > 90:
-        clean = clean[:90]
-    return clean
-
-async def channel_exists_in_category(category: discord.CategoryChannel, name: str) -> bool:
-    for ch in category.channels:
-        if isinstance(ch, discord.TextChannel) and ch.name == name:
-            return True
-    return False
-
-async def create_private_channel(
-    guild: discord.Guild,
-    *,
-    name: str,
-    category: discord.CategoryChannel,
-    player: discord.Member,
-    prod_role: discord.Role | None,
-    topic: str,
-    intro_message: str
-):
-    overwrites = {
-        guild.default_role: discord.PermissionOverwrite(
-            view_channel=False
-        ),
-        guild.me: discord.PermissionOverwrite(
-            view_channel=True,
-            send_messages=True,
-            read_message_history=True,
-            manage_channels=True,
-            manage_messages=True
-        ),
-        player: discord.PermissionOverwrite(
-            view_channel=True,
-            send_messages=True,
-            read_message_history=True
-        )
-    }
-
-    if prod_role is not None:
-        overwrites[prod_role] = discord.PermissionOverwrite(
-            view_channel=True,
-            send_messages=True,
-            read_message_history=True
-        )
-
-    channel = await guild.create_text_channel(
-        name=name,
-        category=category,
-        overwrites=overwrites,
-        topic=topic
-    )
-
-    await channel.send(intro_message)
-    return channel
-
-
-# ---------------------------
-# FILE I/O HELPERS
-# ---------------------------
-
-def load_json(path: str, fallback: Dict[str, Any]) -> Dict[str, Any]:
-    if not os.path.exists(path):
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(fallback, f, indent=2)
-        return fallback.copy()
-    with open(path, "r", encoding="utf-8") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            # if file is corrupt, reset to fallback
-            return fallback.copy()
-
-def save_json(path: str, data: Dict[str, Any]):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-
-def init_shop_files():
-    kaufhaus_fallback = {
-        "channel_id": 0,
-        "items": {}
-    }
-    schwartz_fallback = {
-        "channel_id": 0,
-        "items": {}
-    }
-    players_fallback = {}
-
-    kauf = load_json(KAUFHAUS_FILE, kaufhaus_fallback)
-    schwar = load_json(SCHWARTZ_FILE, schwartz_fallback)
-    players = load_json(PLAYERS_FILE, players_fallback)
-
-    # Save them back to ensure files exist and are valid
-    save_json(KAUFHAUS_FILE, kauf)
-    save_json(SCHWARTZ_FILE, schwar)
-    save_json(PLAYERS_FILE, players)
-
-    return kauf, schwar, players
-
-
-# ---------------------------
-# SHOP RENDERING
-# ---------------------------
-
-def build_shop_message(shop_data: Dict[str, Any], shop_label: str | None = None) -> str:
-    """
-    Turn the JSON for a shop into a message string.
-    shop_data: loaded JSON for this shop.
-    shop_label: fallback label if shop_data doesn't include 'title'.
-    """
-    # title & intro customizable in the JSON
-    title = shop_data.get("title") or (shop_label or "Shop")
-    intro = shop_data.get("intro") or "Willkommen. Alles hat einen Preis."
-
-    lines = []
-    lines.append(f"**{title}**")
-    lines.append(intro + "\n")
-
-    for item_id, item in shop_data.get("items", {}).items():
-        name = item.get("name", "???")
-        desc = item.get("description", "")
-        price = item.get("price", 0)
-        stock = item.get("stock", "-")
-        public_stock = item.get("public_stock", "n")
-        role_stock = item.get("role_stock", None)
-
-        # Decide what to show for stock
-        if role_stock is not None:
-            shown_stock = "?"
-            if public_stock == "y":
-                numeric_amounts = []
-                for amt in role_stock.values():
-                    if isinstance(amt, int) or (isinstance(amt, str) and amt.isdigit()):
-                        numeric_amounts.append(int(amt))
-                    elif isinstance(amt, str) and amt == "-":
-                        numeric_amounts.append(999999)
-                if numeric_amounts:
-                    m = max(numeric_amounts)
-                    shown_stock = "∞" if m >= 999999 else str(m)
-        else:
-            if stock == "-":
-                shown_stock = "∞" if public_stock == "y" else "?"
-            else:
-                shown_stock = stock if public_stock == "y" else "?"
-
-        lines.append(
-            f"**{name}**  (`{item_id}`)\n"
-            f"{desc}\n"
-            f"Price: {price} DM | In Stock: {shown_stock}\n"
-        )
-
-    # footer (optional)
-    lines.append("\n*Use `!buy <itemID>` to purchase.*")
-    return "\n".join(lines)
-
-
-async def get_last_bot_message(channel: discord.TextChannel, bot_user: discord.User):
-    """
-    Return (message or None) for the most recent message in channel that is either:
-    - the last message in channel at all, if it's from the bot
-    - else None
-    """
-    async for msg in channel.history(limit=1):
-        if msg.author.id == bot_user.id:
-            return msg
-        else:
-            return None
-    return None
-
-
-async def sync_shop_channel(bot: commands.Bot, shop_path: str):
-    """
-    Ensure the shop message in that channel matches the JSON.
-    Creates/edits as needed.
-    """
-    shop_data = load_json(shop_path, {"channel_id": 0, "items": {}})
-    channel_id = shop_data.get("channel_id", 0)
-    if channel_id == 0:
-        return  # shop not configured yet
-
-    channel = bot.get_channel(channel_id)
-    if channel is None:
-        return  # channel doesn't exist / bot can't see it
-
-    # Determine label fallback for title
-    if shop_path == KAUFHAUS_FILE:
-        fallback_label = "Kaufhaus"
-    elif shop_path == SCHWARTZ_FILE:
-        fallback_label = "Schwartzmarkt"
-    else:
-        fallback_label = "Shop"
-
-    desired_text = build_shop_message(shop_data, fallback_label)
-
-    last_bot_msg = await get_last_bot_message(channel, bot.user)
-    if last_bot_msg is None:
-        await channel.send(desired_text)
-    else:
-        if last_bot_msg.content != desired_text:
-            await last_bot_msg.edit(content=desired_text)
-
-
-# ---------------------------
-# ECONOMY / BUY LOGIC
-# ---------------------------
-
-def find_item_in_shops(item_id: str) -> Tuple[str, Dict[str, Any]] | None:
-    """
-    Look for item_id in kaufhaus.json first, then schwartzmarkt.json.
-    Return (which_file, item_dict) or None.
-    """
-    kauf = load_json(KAUFHAUS_FILE, {"channel_id": 0, "items": {}})
-    if item_id in kauf.get("items", {}):
-        return (KAUFHAUS_FILE, kauf["items"][item_id])
-
-    schwar = load_json(SCHWARTZ_FILE, {"channel_id": 0, "items": {}})
-    if item_id in schwar.get("items", {}):
-        return (SCHWARTZ_FILE, schwar["items"][item_id])
-
-    return None
-
-def user_can_afford(user_id: int, cost: int) -> bool:
-    players = load_players()
-    pdata = players.get(str(user_id), {"money": 0, "items": [], "name": "Unknown"})
-    return pdata.get("money", 0) >= cost
-
-def deduct_money_and_give_item(user_id: int, item_id: str, price: int, member_obj: discord.Member | None):
-    """
-    Charge the player, add the item to their inventory, and keep their name synced.
-    member_obj is the discord.Member who bought it (so we can keep name up to date).
-    """
-    players = load_players()
-    uid = str(user_id)
-
-    if uid not in players:
-        # create new if somehow missing
-        players[uid] = {
-            "name": member_obj.display_name if member_obj else "Unknown",
-            "money": 0,
-            "items": []
-        }
-
-    pdata = players[uid]
-
-    # sync the stored name with their current display
-    if member_obj and pdata.get("name") != member_obj.display_name:
-        pdata["name"] = member_obj.display_name
-
-    # deduct
-    current_money = pdata.get("money", 0)
-    pdata["money"] = current_money - price
-    if pdata["money"] < 0:
-        pdata["money"] = 0  # safety, shouldn't really go below
-
-    # add item
-    inv = pdata.get("items", [])
-    inv.append(item_id)
-    pdata["items"] = inv
-
-    players[uid] = pdata
-    save_players(players)
-
-def reduce_stock(which_file: str, item_id: str, buyer_roles: Tuple[int, ...]) -> bool:
-    """
-    Returns True if stock was successfully reduced (or unlimited)
-    Returns False if no stock.
-    We also write updated file.
-    """
-    shop = load_json(which_file, {"channel_id": 0, "items": {}})
-
-    item = shop["items"][item_id]
-
-    global_stock = item.get("stock", "-")
-    role_stock = item.get("role_stock", None)
-
-    # If there's role_stock, we try to consume from the first matching role the buyer has.
-    # Priority: role_stock first (special per-tribe limit), then global.
-    if role_stock:
-        # find a role in buyer_roles that appears in role_stock with nonzero/available
-        for r in buyer_roles:
-            r_str = str(r)
-            if r_str in role_stock:
-                amt = role_stock[r_str]
-                if amt == "-":
-                    # unlimited for that role
-                    # no reduction needed
-                    save_json(which_file, shop)
-                    return True
-                elif amt.isdigit():
-                    if int(amt) > 0:
-                        # reduce by 1
-                        new_amt = str(int(amt) - 1)
-                        role_stock[r_str] = new_amt
-                        item["role_stock"] = role_stock
-                        shop["items"][item_id] = item
-                        save_json(which_file, shop)
-                        return True
-                    else:
-                        # this role can't buy anymore
-                        return False
-        # no matching role with stock
-        return False
-
-    # else use global
-    if global_stock == "-":
-        # unlimited
-        save_json(which_file, shop)
-        return True
-    elif global_stock.isdigit():
-        if int(global_stock) > 0:
-            new_amt = str(int(global_stock) - 1)
-            item["stock"] = new_amt
-            shop["items"][item_id] = item
-            save_json(which_file, shop)
-            return True
-        else:
-            return False
-
-    # fallback deny
-    return False
-
-# ---------------------------
-# Creating Wallets
-# ---------------------------
-
-def load_players() -> dict:
-    """Load players.json (ID -> wallet info)."""
-    return load_json(PLAYERS_FILE, {})
-
-def save_players(players: dict):
-    """Write players.json back to disk."""
-    save_json(PLAYERS_FILE, players)
-
-def ensure_player_entry(user: discord.Member, players: dict) -> bool:
-    """
-    Make sure this user exists in players.json.
-    If they don't, create them with name/money/items.
-    If they DO exist, update the stored name in case it changed.
-    Returns True if this was a NEW entry (not previously there),
-    False if it already existed.
-    """
-    uid = str(user.id)
-    display = user.display_name
-
-    if uid not in players:
-        players[uid] = {
-            "name": display,
-            "money": 0,
-            "items": []
-        }
-        return True
-    else:
-        # update name if it's different
-        if players[uid].get("name") != display:
-            players[uid]["name"] = display
-        # leave money/items alone
-        return False
-
-def get_user_wallet_dict(user_id: int) -> dict:
-    """
-    Return a dict with {name, money, items}.
-    If the user isn't in players.json yet, we fabricate a temp zero wallet.
-    We DON'T save that temp wallet here; saving/creation is handled elsewhere.
-    """
-    players = load_players()
-    entry = players.get(str(user_id))
-
-    if entry is None:
-        # fabricate a blank preview
-        return {
-            "name": "Unknown",
-            "money": 0,
-            "items": []
-        }
-
-    return {
-        "name": entry.get("name", "Unknown"),
-        "money": entry.get("money", 0),
-        "items": entry.get("items", [])
-    }
-
-def resolve_item_name(item_id: str) -> str:
-    """
-    Look up a prettier name for an itemID by checking kaufhaus.json or schwartzmarkt.json.
-    Fall back to the raw ID if not found.
-    """
-    kauf = load_json(KAUFHAUS_FILE, {"channel_id": 0, "items": {}})
-    schwar = load_json(SCHWARTZ_FILE, {"channel_id": 0, "items": {}})
-
-    if item_id in kauf.get("items", {}):
-        return kauf["items"][item_id].get("name", item_id)
-    if item_id in schwar.get("items", {}):
-        return schwar["items"][item_id].get("name", item_id)
-    return item_id
-
-def format_wallet_message(user: discord.Member) -> str:
-    """
-    Build the string we show in /wallet.
-    """
-    w = get_user_wallet_dict(user.id)
-    money = w["money"]
-    items_list = w["items"]
-
-    if items_list:
-        pretty_items = [f"{resolve_item_name(i)} (`{i}`)" for i in items_list]
-        items_str = "\n".join(f"- {x}" for x in pretty_items)
-    else:
-        items_str = "No items."
-
-    msg = (
-        f"Wallet for **{user.display_name}** "
-        f"(stored as \"{w['name']}\"):\n"
-        f"Money: {money} DM\n"
-        f"Items:\n{items_str}"
-    )
-    return msg
-
-def is_host(member: discord.Member) -> bool:
-    """
-    Host permissions check.
-    You can tweak this however you want (host role, admin, etc.).
-    """
-    if member.guild_permissions.administrator:
-        return True
-    for r in member.roles:
-        if r.id == HOST_ROLE_ID:
-            return True
-    return False
-
-# ---------------------------
-# BOT SETUP
-# ---------------------------
-
-class GCBot(commands.Bot):
-    def __init__(self):
-        super().__init__(
-            command_prefix="!",
-            intents=intents,
-            help_command=None
-        )
-
-    async def setup_hook(self):
-        # GLOBAL SYNC ONLY
-        await self.tree.sync()
-        print("Slash commands synced.")
-
-
-
-bot = GCBot()
-
-
-# ---------------------------
-# SLASH COMMAND: /confsetup
-# ---------------------------
-
-@bot.tree.command(
-    name="confsetup",
-    description="Create conf/submission channels for each member of a role."
-)
-@app_commands.describe(
-    role="Players role.",
-    conf_category="Category for confessionals.",
-    submissions_category="Category for submissions (optional).",
-    prod_role="Staff role with access (optional)."
-)
-async def confsetup(
-    interaction: discord.Interaction,
-    role: discord.Role,
-    conf_category: discord.CategoryChannel,
-    submissions_category: discord.CategoryChannel | None = None,
-    prod_role: discord.Role | None = None
-):
-    guild = interaction.guild
-    if guild is None:
-        await interaction.response.send_message(
-            "Use this in a server.",
-            ephemeral=True
-        )
-        return
-
-    await interaction.response.defer(ephemeral=True, thinking=True)
-
-    players_role_members = role.members
-
-    created_conf_channels = []
-    created_sub_channels = []
-    skipped_conf_existing = []
-    skipped_sub_existing = []
-
-    for member in players_role_members:
-        base_name = sanitize_channel_name(member.display_name)
-
-        # Conf channel
-        conf_name = base_name
-        already_conf = await channel_exists_in_category(conf_category, conf_name)
-
-        if already_conf:
-            skipped_conf_existing.append((member, conf_name))
-        else:
-            topic = f"Confessional for {member.display_name}"
-            intro_msg = (
-                f"Willkommen to your confessional, {member.mention}. "
-                "Report your thoughts here. Alles wird überwacht. 🕵️"
-            )
-            ch = await create_private_channel(
-                guild,
-                name=conf_name,
-                category=conf_category,
-                player=member,
-                prod_role=prod_role,
-                topic=topic,
-                intro_message=intro_msg
-            )
-            created_conf_channels.append((member, ch))
-
-        # Submissions channel
-        if submissions_category is not None:
-            sub_name = f"{base_name}-submissions"
-            already_sub = await channel_exists_in_category(submissions_category, sub_name)
-
-            if already_sub:
-                skipped_sub_existing.append((member, sub_name))
-            else:
-                topic_sub = f"Challenge submissions for {member.display_name}"
-                intro_sub = (
-                    f"{member.mention} — post your official answers here. "
-                    "Edits after deadline will not count."
-                )
-                subch = await create_private_channel(
-                    guild,
-                    name=sub_name,
-                    category=submissions_category,
-                    player=member,
-                    prod_role=prod_role,
-                    topic=topic_sub,
-                    intro_message=intro_sub
-                )
-                created_sub_channels.append((member, subch))
-
-        await asyncio.sleep(0.3)
-
-    summary_lines = []
-    summary_lines.append(f"Done in **{guild.name}**.")
-    summary_lines.append(f"Players with {role.mention}: {len(players_role_members)}")
-
-    if created_conf_channels:
-        summary_lines.append(
-            f"Created {len(created_conf_channels)} confessional channel(s) in {conf_category.name}."
-        )
-    if skipped_conf_existing:
-        summary_lines.append(
-            f"Skipped {len(skipped_conf_existing)} confessional channel(s) (already existed)."
-        )
-
-    if submissions_category is not None:
-        if created_sub_channels:
-            summary_lines.append(
-                f"Created {len(created_sub_channels)} submissions channel(s) in {submissions_category.name}."
-            )
-        if skipped_sub_existing:
-            summary_lines.append(
-                f"Skipped {len(skipped_sub_existing)} submissions channel(s) (already existed)."
-            )
-
-    await interaction.followup.send(
-        "\n".join(summary_lines),
-        ephemeral=True
-    )
-@bot.tree.command(
-    name="wallet",
-    description="Check a wallet. Hosts can view anyone; players can view themselves."
-)
-@app_commands.describe(
-    player="Whose wallet to view. Leave empty to view your own."
-)
-async def wallet_cmd(
-    interaction: discord.Interaction,
-    player: discord.Member | None = None
-):
-    guild = interaction.guild
-    if guild is None:
-        await interaction.response.send_message(
-            "Use this in a server.",
-            ephemeral=True
-        )
-        return
-
-    requester: discord.Member = interaction.user
-
-    # Who are we allowed to inspect?
-    if is_host(requester):
-        target = player or requester
-    else:
-        if player is None or player.id == requester.id:
-            target = requester
-        else:
-            await interaction.response.send_message(
-                "You can only view your own wallet.",
-                ephemeral=True
-            )
-            return
-
-    msg = format_wallet_message(target)
-
-    await interaction.response.send_message(
-        msg,
-        ephemeral=True
-    )
-@bot.tree.command(
-    name="walletcreate",
-    description="Add players to the economy file with empty wallets (hosts only)."
-)
-@app_commands.describe(
-    user="Create/update wallet for this user.",
-    role="Or create/update wallets for everyone with this role."
-)
-async def walletcreate_cmd(
-    interaction: discord.Interaction,
-    user: discord.Member | None = None,
-    role: discord.Role | None = None
-):
-    guild = interaction.guild
-    if guild is None:
-        await interaction.response.send_message(
-            "Use this in a server.",
-            ephemeral=True
-        )
-        return
-
-    requester: discord.Member = interaction.user
-
-    # Only hosts:
-    if not is_host(requester):
-        await interaction.response.send_message(
-            "You do not have permission to do that.",
-            ephemeral=True
-        )
-        return
-
-    players = load_players()
-
-    new_count = 0
-    touched_members: list[discord.Member] = []
-
-    # Single user
-    if user is not None:
-        if ensure_player_entry(user, players):
-            new_count += 1
-        touched_members.append(user)
-
-    # Role batch
-    if role is not None:
-        for m in role.members:
-            if ensure_player_entry(m, players):
-                new_count += 1
-            touched_members.append(m)
-
-    save_players(players)
-
-    if not touched_members:
-        summary = "No targets provided. Specify a user or a role."
-    else:
-        uniq_ids = {m.id for m in touched_members}
-        summary = (
-            f"Registered {len(uniq_ids)} player(s). "
-            f"New wallets created: {new_count}."
-        )
-
-    await interaction.response.send_message(
-        summary,
-        ephemeral=True
-    ) 
-
-# ---------------------------
-# TEXT COMMAND: !buy
-# ---------------------------
-
-@bot.command(name="buy")
-async def buy_command(ctx: commands.Context, item_id: str):
-    """
-    !buy <itemID>
-    - checks price, stock, money
-    - deducts money
-    - grants item
-    - announces purchase
-    - refreshes shop messages
-    """
-    buyer = ctx.author
-    buyer_id = buyer.id
-    buyer_roles = tuple([r.id for r in buyer.roles if not r.is_default()])
-
-    # find item in either shop
-    res = find_item_in_shops(item_id)
-    if res is None:
-        await ctx.send(f"{buyer.mention} That item doesn't exist.")
-        return
-
-    which_file, item_data = res
-    price = int(item_data.get("price", 0))
-
-    # check stock availability without mutating yet
-    # we'll simulate reduce_stock() logic lightly:
-    # 1) if role_stock exists, see if any buyer role has >0 or "-"
-    # 2) else check global
-    role_stock = item_data.get("role_stock", None)
-    global_stock = item_data.get("stock", "-")
-
-    def has_role_stock():
-        if not role_stock:
-            return False
-        for r in buyer_roles:
-            r_str = str(r)
-            if r_str in role_stock:
-                amt = role_stock[r_str]
-                if amt == "-":
-                    return True
-                if amt.isdigit() and int(amt) > 0:
-                    return True
-        return False
-
-    def has_global_stock():
-        if role_stock:
-            return False  # priority to role_stock, treat as gated
-        if global_stock == "-":
-            return True
-        if global_stock.isdigit() and int(global_stock) > 0:
-            return True
-        return False
-
-    stock_ok = has_role_stock() or has_global_stock()
-    if not stock_ok:
-        await ctx.send(f"{buyer.mention} That item is sold out for you.")
-        return
-
-    # check money
-    if not user_can_afford(buyer_id, price):
-        await ctx.send(f"{buyer.mention} You don't have enough Deutsche Marks.")
-        return
-
-    # actually deduct 1 stock and charge
-    took_stock = reduce_stock(which_file, item_id, buyer_roles)
-    if not took_stock:
-        await ctx.send(f"{buyer.mention} Someone just grabbed the last one. Too slow.")
-        return
-
-    # now take money and add item to inventory
-    deduct_money_and_give_item(buyer_id, item_id, price, ctx.author)
-
-    # Announce
-    item_name = item_data.get("name", item_id)
-    await ctx.send(
-        f"Congratulations, {buyer.mention}! You just bought **{item_name}**. ||{HOST_PING}||"
-    )
-
-    # re-sync shop messages so stock display updates
-    await sync_shop_channel(bot, KAUFHAUS_FILE)
-    await sync_shop_channel(bot, SCHWARTZ_FILE)
-
-
-# ---------------------------
-# EVENTS
-# ---------------------------
-
-@bot.event
-async def on_ready():
-    # init files
-    init_shop_files()
-
-    # set status
-    await bot.change_presence(
-        activity=discord.CustomActivity(name="Coming up with challenges")
-    )
-
-    # sync both shop channels to reflect latest JSON on startup
-    await sync_shop_channel(bot, KAUFHAUS_FILE)
-    await sync_shop_channel(bot, SCHWARTZ_FILE)
-
-    print(f"GCbot is online as {bot.user} (id={bot.user.id})")
-@bot.event
-async def on_ready():
-    # init files
-    init_shop_files()
-
-    # set status
-    await bot.change_presence(
-        activity=discord.CustomActivity(name="Coming up with challenges")
-    )
-
-    # sync shop channels
-    await sync_shop_channel(bot, KAUFHAUS_FILE)
-    await sync_shop_channel(bot, SCHWARTZ_FILE)
-
-    print(f"GCbot is online as {bot.user} (id={bot.user.id})")
-
-# ---------------------------
-# RUN
-# ---------------------------
-
-if __name__ == "__main__":
-    if BOT_TOKEN == "PUT_YOUR_TOKEN_HERE":
-        raise RuntimeError("You forgot to set BOT_TOKEN in the script.")
-    bot.run(BOT_TOKEN)
+import discord
+from discord import app_commands
+from discord.ext import commands
+import re
+import asyncio
+import os
+import json
+import math
+import hashlib
+import sqlite3
+import copy
+import contextlib
+import time
+import bisect
+import functools
+import heapq
+from datetime import datetime, timezone
+import aiohttp
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, Tuple
+
+# ---------------------------
+# CONFIG / INTENTS
+# ---------------------------
+
+intents = discord.Intents.default()
+intents.guilds = True
+intents.members = True  # needed to fetch members on demand (see fetch_role_members)
+intents.message_content = True  # <- we need this now to read !buy
+BOT_TOKEN = "BOT_TOKEN"  # rotate your old token and paste new one here
+
+KAUFHAUS_FILE = "kaufhaus.json"
+SCHWARTZ_FILE = "schwartzmarkt.json"
+PLAYERS_FILE = "players.json"
+PROVISION_FILE = "provisioning.json"
+COMMAND_SYNC_FILE = "command_sync.json"  # hash of the last slash command tree pushed to Discord
+SCHEDULE_FILE = "schedule.json"  # timed restocks / price changes / openings (see /schedule)
+
+STORAGE_BACKEND = "json"  # "json" (the files above + a journal) or "sqlite"
+
+HOST_PING = "<@&1427964239443656764>"  # change to your staff/host role mention for the ||@hosts|| part
+HOST_ROLE_ID = 1427964239443656764  # change this to the same thing, but just the numebrs
+HOST_CHANNEL_ID = 0  # channel for bot warnings to hosts (0 = only print them)
+DEV_GUILD_ID = 0  # sync slash commands to this guild only (instant updates while testing); 0 = global
+
+PROVISION_CONCURRENCY = 4  # /confsetup: channel creations in flight at once
+PROGRESS_INTERVAL = 2.0  # /confsetup: seconds between progress updates
+MEMBER_CACHE_TTL = 300.0  # seconds a fetched list of a role's members is reused
+
+IO_QUEUE_LIMIT = 8  # disk jobs waiting at once before callers have to wait for a slot
+RENDER_CACHE_SIZE = 1024  # rendered wallets/shops kept in memory
+ANNOUNCE_WINDOW = 3.0  # seconds: purchase announcements this close together become one digest message
+
+METRICS_ENABLED = True  # command latencies, I/O and Discord API counters for /stats
+METRICS_FILE = ""  # e.g. "metrics.prom" to also write them in Prometheus text format
+METRICS_WRITE_INTERVAL = 30.0  # seconds between writes of METRICS_FILE
+
+
+# ---------------------------
+# BASIC HELPERS
+# ---------------------------
+
+def sanitize_channel_name(name: str) -> str:
+    clean = name.lower()
+    clean = clean.replace(" ", "-").replace("_", "-")
+    clean = re.sub(r"[^a-z0-9\-]", "", clean)
+    clean = re.sub(r"-{2,}", "-", clean)
+    clean = clean.strip("-")
+    if len(clean) == 0:
+        clean = "player"
+    if len(clean) > 90:
+        clean = clean[:90]
+    return clean
+
+def member_owns_channel(channel: discord.TextChannel, member: discord.Member) -> bool:
+    """True if the channel has a permission overwrite for this member."""
+    return any(target.id == member.id for target in channel.overwrites)
+
+def plan_category_channels(
+    category: discord.CategoryChannel,
+    members: list[discord.Member],
+    plan: Dict[str, int],
+    suffix: str = ""
+) -> Tuple[list, list]:
+    """
+    Work out which members still need a private channel in this category.
+    plan: member ID -> channel ID for this category (from provisioning.json).
+          Existing channels we recognize get added to it.
+    Returns (existing, missing):
+      existing = [(member, channel)] already done
+      missing  = [(member, name)] still to create
+    Names are unique within the category: members go in ID order and when
+    two display names sanitize to the same thing, the later ones get -2, -3, ...
+    """
+    # one pass over the category, everything after that is dict lookups
+    channels = {ch.id: ch for ch in category.channels if isinstance(ch, discord.TextChannel)}
+    by_name = {ch.name: ch for ch in channels.values()}
+    taken = set(by_name)
+    claimed = {cid for cid in plan.values() if cid in channels}
+
+    existing = []
+    missing = []
+    pending = []
+
+    for member in sorted(members, key=lambda m: m.id):
+        cid = plan.get(str(member.id))
+        if cid in channels:
+            existing.append((member, channels[cid]))
+        else:
+            pending.append(member)
+
+    for member in pending:
+        base = sanitize_channel_name(member.display_name)
+        n = 1
+        while True:
+            name = (base if n == 1 else f"{base}-{n}") + suffix
+            ch = by_name.get(name)
+            if ch is None and name not in taken:
+                taken.add(name)
+                missing.append((member, name))
+                break
+            if ch is not None and ch.id not in claimed and member_owns_channel(ch, member):
+                # made before we kept a plan (or the plan got lost): adopt it
+                claimed.add(ch.id)
+                plan[str(member.id)] = ch.id
+                existing.append((member, ch))
+                break
+            n += 1
+
+    return existing, missing
+
+async def create_private_channel(
+    guild: discord.Guild,
+    *,
+    name: str,
+    category: discord.CategoryChannel,
+    player: discord.Member,
+    prod_role: discord.Role | None,
+    topic: str,
+    intro_message: str
+):
+    overwrites = {
+        guild.default_role: discord.PermissionOverwrite(
+            view_channel=False
+        ),
+        guild.me: discord.PermissionOverwrite(
+            view_channel=True,
+            send_messages=True,
+            read_message_history=True,
+            manage_channels=True,
+            manage_messages=True
+        ),
+        player: discord.PermissionOverwrite(
+            view_channel=True,
+            send_messages=True,
+            read_message_history=True
+        )
+    }
+
+    if prod_role is not None:
+        overwrites[prod_role] = discord.PermissionOverwrite(
+            view_channel=True,
+            send_messages=True,
+            read_message_history=True
+        )
+
+    channel = await guild.create_text_channel(
+        name=name,
+        category=category,
+        overwrites=overwrites,
+        topic=topic
+    )
+
+    await channel.send(intro_message)
+    return channel
+
+
+# ---------------------------
+# MEMBER LOOKUPS
+# ---------------------------
+# The bot doesn't download every guild's member list at startup (see
+# GCBot), so role.members only knows whoever happens to be cached.
+# Commands that need everyone with a role fetch them here instead.
+
+# role ID -> (time.monotonic() of the fetch, members with that role)
+_role_members: Dict[int, Tuple[float, list[discord.Member]]] = {}
+_role_member_fetches: Dict[int, asyncio.Task] = {}
+
+async def fetch_role_members(guild: discord.Guild, role: discord.Role) -> list[discord.Member]:
+    """
+    Everyone with this role. Pages through the guild's member list once
+    and keeps only the role's members, reused for MEMBER_CACHE_TTL seconds.
+    Callers asking for the same role at the same time share one fetch.
+    """
+    cached = _role_members.get(role.id)
+    if cached is not None and time.monotonic() - cached[0] < MEMBER_CACHE_TTL:
+        return cached[1]
+
+    task = _role_member_fetches.get(role.id)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(_fetch_role_members(guild, role.id))
+        _role_member_fetches[role.id] = task
+        task.add_done_callback(lambda _: _role_member_fetches.pop(role.id, None))
+    return await asyncio.shield(task)
+
+async def _fetch_role_members(guild: discord.Guild, role_id: int) -> list[discord.Member]:
+    members = [m async for m in guild.fetch_members(limit=None) if m.get_role(role_id) is not None]
+    _role_members[role_id] = (time.monotonic(), members)
+    return members
+
+
+# ---------------------------
+# METRICS
+# ---------------------------
+# Plain counters and fixed-bucket latency histograms, all in memory.
+# With METRICS_ENABLED off, inc()/observe() return right away, commands
+# aren't wrapped and no trace hooks are attached to the HTTP session.
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+
+METRIC_HELP = {
+    "json_loads": "JSON files read",
+    "json_saves": "JSON snapshots written",
+    "bytes_written": "Bytes written to snapshots and the journal",
+    "rest_calls": "Discord REST requests",
+    "rest_429s": "Discord REST requests answered with 429",
+    "shop_edits": "Shop messages edited or posted",
+    "shop_edits_skipped": "Shop messages left alone because they didn't change",
+    "render_cache_hits": "Wallet/shop renders served from the render cache",
+    "render_cache_misses": "Wallet/shop renders that had to be built",
+    "announcements": "Purchase announcements",
+    "announcement_messages": "Messages sent for purchase announcements (digests count once)",
+}
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # last one is +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket the q-th observation falls in."""
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else math.inf
+        return 0.0
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.counters: Dict[str, int] = {name: 0 for name in METRIC_HELP}
+        self.latency: Dict[str, LatencyHistogram] = {}
+
+    def inc(self, name: str, amount: int = 1):
+        if not METRICS_ENABLED:
+            return
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, command: str, seconds: float):
+        if not METRICS_ENABLED:
+            return
+        hist = self.latency.get(command)
+        if hist is None:
+            hist = self.latency[command] = LatencyHistogram()
+        hist.observe(seconds)
+
+    def format_prometheus(self) -> str:
+        lines = []
+        for name, value in self.counters.items():
+            lines.append(f"# HELP gcbot_{name}_total {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE gcbot_{name}_total counter")
+            lines.append(f"gcbot_{name}_total {value}")
+
+        lines.append("# HELP gcbot_command_seconds Time spent handling a command")
+        lines.append("# TYPE gcbot_command_seconds histogram")
+        for command, hist in sorted(self.latency.items()):
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), hist.buckets):
+                cumulative += n
+                lines.append(f'gcbot_command_seconds_bucket{{command="{command}",le="{bound}"}} {cumulative}')
+            lines.append(f'gcbot_command_seconds_sum{{command="{command}"}} {hist.total:.6f}')
+            lines.append(f'gcbot_command_seconds_count{{command="{command}"}} {hist.count}')
+        return "\n".join(lines) + "\n"
+
+    def format_summary(self) -> str:
+        """Human-readable version for /stats."""
+        uptime = int(time.time() - self.started)
+        lines = [f"**Bot stats** (up {uptime // 3600}h {uptime % 3600 // 60}m)"]
+
+        def ms(seconds: float) -> str:
+            return "> 30 s" if seconds == math.inf else f"≤ {seconds * 1000:g} ms"
+
+        if self.latency:
+            lines.append("Commands:")
+            for command, hist in sorted(self.latency.items()):
+                lines.append(
+                    f"`{command}` {hist.count}x, avg {hist.total / hist.count * 1000:.0f} ms, "
+                    f"p50 {ms(hist.quantile(0.5))}, p99 {ms(hist.quantile(0.99))}"
+                )
+        else:
+            lines.append("Commands: none handled yet.")
+
+        c = self.counters
+        lines.append(
+            f"JSON loads: {c['json_loads']} | JSON saves: {c['json_saves']} | "
+            f"Written: {c['bytes_written'] / 1024:.1f} KiB"
+        )
+        lines.append(f"Discord REST calls: {c['rest_calls']} | 429s: {c['rest_429s']}")
+        lines.append(f"Shop messages edited: {c['shop_edits']} | skipped (unchanged): {c['shop_edits_skipped']}")
+        lines.append(f"Render cache: {c['render_cache_hits']} hits | {c['render_cache_misses']} misses")
+        lines.append(f"Announcements: {c['announcements']} in {c['announcement_messages']} message(s)")
+        return "\n".join(lines)
+
+
+metrics = Metrics()
+
+def timed_command(name: str):
+    """
+    Decorator for command callbacks: records how long each call took
+    under `name`. Leaves the callback untouched when metrics are off.
+    """
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                metrics.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def make_http_trace() -> aiohttp.TraceConfig | None:
+    """aiohttp hooks that count every request discord.py makes (and its 429s)."""
+    if not METRICS_ENABLED:
+        return None
+
+    async def on_request_end(session, ctx, params):
+        metrics.inc("rest_calls")
+        if params.response.status == 429:
+            metrics.inc("rest_429s")
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+def write_metrics_file(text: str):
+    tmp_path = METRICS_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, METRICS_FILE)
+
+async def write_metrics_async():
+    if not METRICS_FILE:
+        return
+    try:
+        await disk.run(write_metrics_file, metrics.format_prometheus())
+    except OSError as e:
+        print(f"Could not write {METRICS_FILE}: {e}")
+
+async def write_metrics_periodically():
+    while True:
+        await asyncio.sleep(METRICS_WRITE_INTERVAL)
+        await write_metrics_async()
+
+
+# ---------------------------
+# FILE I/O HELPERS
+# ---------------------------
+
+def load_json(path: str, fallback: Dict[str, Any]) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(fallback, f, indent=2)
+        return copy.deepcopy(fallback)
+    metrics.inc("json_loads")
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError as e:
+            # never fall back to an empty file here: the next snapshot
+            # would overwrite every wallet with it
+            raise RuntimeError(
+                f"{path} is not valid JSON ({e}). Fix or remove it before starting the bot."
+            ) from e
+
+def save_json(path: str, data: Dict[str, Any]):
+    """
+    Write to a temp file and rename it over the real one,
+    so a crash mid-write leaves the old file intact.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+        written = f.tell()
+    os.replace(tmp_path, path)
+    metrics.inc("json_saves")
+    metrics.inc("bytes_written", written)
+
+def read_json_file(path: str) -> Any:
+    """Parse a file as JSON, no fallback. For files a host may have broken."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def get_file_stamp(path: str) -> Tuple[int, int] | None:
+    """(mtime, size) of a file, or None if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def file_changed_since(path: str, stamp: Tuple[int, int] | None) -> bool:
+    """Was the file changed (not deleted) after we saw it at `stamp`?"""
+    current = get_file_stamp(path)
+    return current is not None and current != stamp
+
+class DiskWorker:
+    """
+    All blocking file work (parsing, serializing, writing, fsync, SQLite)
+    goes through here so it never holds up the event loop: one thread,
+    jobs run in the order they were handed in.
+    At most IO_QUEUE_LIMIT jobs wait at once; after that run() waits for a
+    slot instead of letting the backlog grow without bound.
+    Callers hand in data that is already a snapshot (see JsonStore.dump),
+    the loop keeps mutating the live state while the job runs.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gcbot-disk")
+        self._slots: asyncio.Semaphore | None = None
+
+    async def run(self, fn, *args):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(IO_QUEUE_LIMIT)
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+
+disk = DiskWorker()
+
+async def load_json_async(path: str, fallback: Dict[str, Any]) -> Dict[str, Any]:
+    return await disk.run(load_json, path, fallback)
+
+async def save_json_async(path: str, data: Dict[str, Any]):
+    """data must not be mutated until this returns (pass a copy if it might be)."""
+    await disk.run(save_json, path, data)
+
+def init_shop_files():
+    """
+    Load both shops and players.json into memory (once per process),
+    then let the backend recover whatever it recorded after the last snapshot.
+    Missing files get created with empty defaults by load_json.
+    """
+    if all(store.loaded for store in ALL_STORES):
+        return kaufhaus_store.data, schwartz_store.data, player_store.data
+
+    for store in ALL_STORES:
+        if not store.loaded:
+            store.load()
+
+    recovered = storage.recover()
+    if recovered:
+        print(f"Recovered {recovered} journal entries.")
+    if recovered or any(store.dirty for store in ALL_STORES):
+        flush_all()
+
+    return kaufhaus_store.data, schwartz_store.data, player_store.data
+
+
+# ---------------------------
+# IN-MEMORY STATE
+# ---------------------------
+# Everything the commands need lives here once init_shop_files() has run.
+# Commands read and mutate store.data directly. Small changes (one wallet,
+# one item) go to the storage backend as they happen (record_player /
+# record_item); bigger changes call mark_dirty(), which schedules a full
+# snapshot of that store a couple seconds later.
+
+FLUSH_DELAY = 2.0  # seconds between a mark_dirty() and the snapshot
+
+
+class JsonStore:
+    """
+    One JSON document kept resident in memory, persisted by the storage backend.
+    """
+
+    def __init__(self, path: str, fallback: Dict[str, Any]):
+        self.path = path
+        self.fallback = fallback
+        self.data: Dict[str, Any] = copy.deepcopy(fallback)
+        self.loaded = False
+        self.dirty = False
+        # (mtime, size) of the file as we last read/wrote it, see watch_shop_files
+        self.file_stamp: Tuple[int, int] | None = None
+
+    def load(self):
+        self.data = self.parse(storage.load_store(self))
+        self.loaded = True
+        self.dirty = False
+        self.file_stamp = get_file_stamp(self.path)
+
+    def parse(self, raw: Dict[str, Any]) -> Dict[str, Any]:
+        """Stored form -> in-memory form."""
+        return raw
+
+    def dump(self) -> Dict[str, Any]:
+        """
+        In-memory form -> stored form. Returns new containers: the snapshot
+        gets written on the disk thread while commands keep changing store.data.
+        """
+        return copy.deepcopy(self.data)
+
+    def mark_dirty(self):
+        """Whole-document change: schedule a snapshot."""
+        self.dirty = True
+        schedule_flush()
+
+
+class ShopStore(JsonStore):
+    """
+    kaufhaus.json / schwartzmarkt.json.
+    label is the title we fall back to if the JSON has none.
+    """
+
+    def __init__(self, path: str, label: str):
+        super().__init__(path, {"channel_id": 0, "items": {}})
+        self.label = label
+        # bumped when items are added, removed or replaced (not on stock changes)
+        self.layout_version = 0
+        # bumped on anything that changes how the shop looks (see RenderCache)
+        self.revision = 0
+
+    def load(self):
+        super().load()
+        self.items_changed()
+
+    def items_changed(self):
+        self.layout_version += 1
+        self.revision += 1
+
+    def item_changed(self, item_id: str, reason: str):
+        """One item's stock/price/etc. changed in place: persist it."""
+        self.revision += 1
+        storage.record_item(self.path, item_id, reason)
+
+    def settings_changed(self):
+        """A shop-level key ("open", ...) changed in place: snapshot the shop."""
+        self.revision += 1
+        self.mark_dirty()
+
+    @property
+    def is_open(self) -> bool:
+        return self.data.get("open", True) is not False
+
+    def parse(self, raw: Dict[str, Any]) -> Dict[str, Any]:
+        return parse_shop(raw)
+
+    def dump(self) -> Dict[str, Any]:
+        return dump_shop(self.data)
+
+    @property
+    def items(self) -> Dict[str, Any]:
+        return self.data.setdefault("items", {})
+
+
+class PlayerStore(JsonStore):
+    """
+    players.json (ID -> wallet info).
+    Inventories are item ID -> count. Old files with a plain list of
+    item IDs get converted on load and written back in the new form.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path, {})
+        self._migrated = 0
+        # uid -> revision, bumped on every change to that wallet (see RenderCache);
+        # generation covers replacing the whole dict
+        self.revisions: Dict[str, int] = {}
+        self.generation = 0
+
+    def load(self):
+        super().load()
+        self.generation += 1
+        if self._migrated:
+            print(f"Converted {self._migrated} inventory list(s) in {self.path} to counts.")
+            # not mark_dirty(): a flush now would truncate the journal before
+            # it's replayed. init_shop_files writes it out after recovery
+            self.dirty = True
+
+    def parse(self, raw: Dict[str, Any]) -> Dict[str, Any]:
+        self._migrated = sum(1 for pdata in raw.values() if normalize_wallet(pdata))
+        return raw
+
+    def dump(self) -> Dict[str, Any]:
+        # wallets are flat apart from the inventory, this is a lot
+        # cheaper than a deepcopy of thousands of them
+        return {uid: copy_wallet(pdata) for uid, pdata in self.data.items()}
+
+    def wallet_changed(self, uid: str, reason: str, items: Iterable[str] | None = None):
+        """
+        A wallet was changed in place: persist it.
+        items: the item IDs whose count changed, None if it could be any.
+        """
+        self.revisions[uid] = self.revisions.get(uid, 0) + 1
+        storage.record_player(uid, reason, items)
+
+    def wallet_revision(self, uid: str) -> Tuple[int, int]:
+        return (self.generation, self.revisions.get(uid, 0))
+
+
+def copy_wallet(pdata: Dict[str, Any]) -> Dict[str, Any]:
+    wallet = dict(pdata)
+    wallet["items"] = dict(pdata.get("items") or {})
+    return wallet
+
+
+def normalize_wallet(pdata: Dict[str, Any]) -> bool:
+    """
+    Turn a list inventory (one entry per copy) into item ID -> count, in place.
+    Returns True if anything had to be converted.
+    """
+    items = pdata.get("items")
+    if isinstance(items, dict):
+        return False
+    counts: Dict[str, int] = {}
+    for item_id in items or []:
+        counts[item_id] = counts.get(item_id, 0) + 1
+    pdata["items"] = counts
+    return True
+
+
+kaufhaus_store = ShopStore(KAUFHAUS_FILE, "Kaufhaus")
+schwartz_store = ShopStore(SCHWARTZ_FILE, "Schwartzmarkt")
+player_store = PlayerStore(PLAYERS_FILE)
+
+# lookup order matters: kaufhaus wins if an ID exists in both
+SHOP_STORES: Dict[str, ShopStore] = {
+    KAUFHAUS_FILE: kaufhaus_store,
+    SCHWARTZ_FILE: schwartz_store,
+}
+ALL_STORES: Tuple[JsonStore, ...] = (kaufhaus_store, schwartz_store, player_store)
+
+_flush_task: asyncio.Task | None = None
+
+def flush_all():
+    """
+    Checkpoint: write every dirty store through the backend right now
+    (for the JSON backend this also compacts the journal).
+    Blocks; from a coroutine use flush_all_async.
+    """
+    storage.checkpoint()
+
+async def flush_all_async():
+    """Same as flush_all, but the writing happens on the disk thread."""
+    await disk.run(storage.checkpoint_job())
+
+async def _flush_later():
+    await asyncio.sleep(FLUSH_DELAY)
+    await flush_all_async()
+
+def schedule_flush():
+    """
+    Make sure a flush is pending. Repeated calls inside the delay
+    window share the same flush.
+    Outside of a running event loop (scripts, tools) we just write immediately.
+    """
+    global _flush_task
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        flush_all()
+        return
+    if _flush_task is None or _flush_task.done():
+        _flush_task = loop.create_task(_flush_later())
+
+
+# ---------------------------
+# STORAGE BACKENDS
+# ---------------------------
+# Where the in-memory stores get persisted. Pick one with STORAGE_BACKEND:
+#   "json"   - the JSON files plus an append-only journal (default)
+#   "sqlite" - one SQLite database, a purchase is one short transaction
+# Everything else in the bot only talks to the stores and to `storage`.
+
+class StorageBackend:
+    """
+    Interface the stores and the economy code use to persist changes.
+    """
+
+    # do kaufhaus.json / schwartzmarkt.json always hold the current shops?
+    # Only then can hand edits of them be swapped in (see watch_shop_files)
+    shop_files_are_live = True
+
+    def load_store(self, store: JsonStore) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def write_snapshot(self, store: JsonStore, data: Dict[str, Any]):
+        """Persist a whole store, data being store.dump(). Runs on the disk thread."""
+        raise NotImplementedError
+
+    def record_player(self, uid: str, reason: str, items: Iterable[str] | None = None):
+        """
+        Persist the current state of one wallet. Called on the event loop,
+        inside the purchase locks: only queue the change here.
+        items: the inventory entries that changed (None: maybe all of them).
+        """
+        raise NotImplementedError
+
+    def record_item(self, shop_path: str, item_id: str, reason: str):
+        """Persist the current state of one shop item. Same rules as record_player."""
+        raise NotImplementedError
+
+    async def commit(self):
+        """Wait until everything recorded so far is durable."""
+        raise NotImplementedError
+
+    def recover(self) -> int:
+        """Called once after loading. Returns how many changes were recovered."""
+        return 0
+
+    def take_snapshots(self) -> list[Tuple[JsonStore, Dict[str, Any]]]:
+        snapshots = []
+        for store in ALL_STORES:
+            if store.dirty:
+                snapshots.append((store, store.dump()))
+                store.dirty = False
+        return snapshots
+
+    def write_snapshots(self, snapshots: list[Tuple[JsonStore, Dict[str, Any]]]):
+        for i, (store, data) in enumerate(snapshots):
+            if isinstance(store, ShopStore) and file_changed_since(store.path, store.file_stamp):
+                # a host saved the file and watch_shop_files hasn't picked it
+                # up yet: don't overwrite their edit. Once it's reloaded (or
+                # rejected) the next checkpoint writes the shop again.
+                print(f"{store.path} was edited by hand, not overwriting it before it's reloaded.")
+                store.dirty = True
+                continue
+            try:
+                self.write_snapshot(store, data)
+            except Exception:
+                # try again with the next checkpoint
+                for failed, _ in snapshots[i:]:
+                    failed.dirty = True
+                raise
+            store.file_stamp = get_file_stamp(store.path)
+
+    def checkpoint_job(self):
+        """
+        Take a consistent copy of every dirty store now (event loop) and
+        return a function that writes it out (disk thread).
+        """
+        snapshots = self.take_snapshots()
+        return lambda: self.write_snapshots(snapshots)
+
+    def checkpoint(self):
+        """Write out every dirty store, right here."""
+        self.checkpoint_job()()
+
+    def shop_file_replaced(self, store: JsonStore):
+        """
+        A host edited the shop's JSON file and it is now store.data.
+        Default: persist it like any other whole-store change.
+        """
+        store.dirty = True
+
+
+# ---------------------------
+# JSON BACKEND + JOURNAL
+# ---------------------------
+# Append-only JSONL log of every wallet/item change since the last snapshot.
+# Each line carries the full new record for one wallet or one shop item,
+# so replaying it is idempotent and per-purchase I/O stays O(1) in the
+# number of players. Lines are fsync'd in groups: everything recorded
+# within JOURNAL_GROUP_DELAY shares one write.
+
+JOURNAL_FILE = "economy.journal"
+JOURNAL_GROUP_DELAY = 0.05  # seconds to collect entries before one fsync
+COMPACT_EVERY = 500  # journal entries between snapshot compactions
+
+
+class Journal:
+    def __init__(self, path: str):
+        self.path = path
+        self.pending: list[Dict[str, Any]] = []
+        self.entries_since_compact = 0
+        self._commit_task: asyncio.Task | None = None
+
+    def record(self, entry: Dict[str, Any]):
+        entry["ts"] = int(time.time())
+        self.pending.append(entry)
+        self.entries_since_compact += 1
+        self._schedule_commit()
+
+    def _schedule_commit(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.write_pending()
+            return
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = loop.create_task(self._commit_later())
+
+    async def _commit_later(self):
+        # loop: entries recorded while we were writing belong to this
+        # commit too (whoever awaits commit() waits for them)
+        while self.pending:
+            await asyncio.sleep(JOURNAL_GROUP_DELAY)
+            await disk.run(self.append, self.take_pending())
+        if self.entries_since_compact >= COMPACT_EVERY:
+            await flush_all_async()
+
+    async def commit(self):
+        """Wait until everything recorded so far is on disk."""
+        task = self._commit_task
+        if task is not None and not task.done():
+            await asyncio.shield(task)
+
+    def take_pending(self) -> list[Dict[str, Any]]:
+        entries = self.pending
+        self.pending = []
+        return entries
+
+    def append(self, entries: list[Dict[str, Any]]):
+        if not entries:
+            return
+        data = "".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in entries)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        metrics.inc("bytes_written", len(data.encode("utf-8")))
+
+    def write_pending(self):
+        self.append(self.take_pending())
+
+    def truncate(self):
+        if os.path.exists(self.path):
+            with open(self.path, "w", encoding="utf-8"):
+                pass
+
+    def replay(self) -> int:
+        """
+        Apply journal entries on top of the loaded snapshots.
+        A torn last line (crash mid-append) is ignored.
+        Returns how many entries were applied.
+        """
+        if not os.path.exists(self.path):
+            return 0
+
+        applied = 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Ignoring unreadable journal line: {line[:80]}")
+                    continue
+
+                op = entry.get("op")
+                if op == "player":
+                    normalize_wallet(entry["wallet"])
+                    player_store.data[entry["uid"]] = entry["wallet"]
+                    player_store.revisions[entry["uid"]] = player_store.revisions.get(entry["uid"], 0) + 1
+                    player_store.dirty = True
+                elif op == "item":
+                    store = SHOP_STORES.get(entry["shop"])
+                    if store is None:
+                        continue
+                    store.items[entry["item_id"]] = parse_item(entry["item"])
+                    store.items_changed()
+                    store.dirty = True
+                else:
+                    continue
+                applied += 1
+
+        self.entries_since_compact = applied
+        return applied
+
+
+class JsonBackend(StorageBackend):
+    """
+    Snapshots in the JSON files, changes in between in the journal.
+    """
+
+    def __init__(self, journal_path: str):
+        self.journal = Journal(journal_path)
+
+    def load_store(self, store: JsonStore) -> Dict[str, Any]:
+        return load_json(store.path, store.fallback)
+
+    def write_snapshot(self, store: JsonStore, data: Dict[str, Any]):
+        save_json(store.path, data)
+
+    def record_player(self, uid: str, reason: str, items: Iterable[str] | None = None):
+        player_store.dirty = True
+        self.journal.record({
+            "op": "player",
+            "reason": reason,
+            "uid": uid,
+            "wallet": copy_wallet(player_store.data[uid])
+        })
+
+    def record_item(self, shop_path: str, item_id: str, reason: str):
+        store = SHOP_STORES[shop_path]
+        store.dirty = True
+        self.journal.record({
+            "op": "item",
+            "reason": reason,
+            "shop": shop_path,
+            "item_id": item_id,
+            "item": dump_item(store.items[item_id])
+        })
+
+    async def commit(self):
+        await self.journal.commit()
+
+    def recover(self) -> int:
+        return self.journal.replay()
+
+    def shop_file_replaced(self, store: JsonStore):
+        # the file on disk already is the new snapshot, no need to rewrite it
+        store.dirty = False
+
+    def checkpoint_job(self):
+        # everything recorded up to now is in the snapshots, so the journal
+        # can start over; whatever gets recorded after this goes to the new one
+        entries = self.journal.take_pending()
+        self.journal.entries_since_compact = 0
+        snapshots = self.take_snapshots()
+
+        def write():
+            # journal first, so a crash between the snapshots and the truncate
+            # replays entries that agree with the snapshots
+            self.journal.append(entries)
+            self.write_snapshots(snapshots)
+            self.journal.truncate()
+        return write
+
+
+# ---------------------------
+# SQLITE BACKEND
+# ---------------------------
+# Same data, normalized: one row per player, per inventory entry, per item
+# and per role-stock counter. The JSON shop files are only read the first
+# time a shop isn't in the database yet, and never written, so hand edits
+# of them aren't picked up while running. stdlib sqlite3, WAL mode.
+# Changes are queued on the event loop and written by the disk thread
+# when someone awaits commit(); after loading, the connection is only
+# used from there.
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    uid TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    money INTEGER NOT NULL,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS inventory (
+    uid TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (uid, item_id)
+);
+CREATE INDEX IF NOT EXISTS inventory_item ON inventory (item_id);
+CREATE TABLE IF NOT EXISTS shops (
+    shop TEXT PRIMARY KEY,
+    meta TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    shop TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    name TEXT,
+    description TEXT,
+    price INTEGER NOT NULL DEFAULT 0,
+    stock TEXT NOT NULL DEFAULT '-',
+    public_stock TEXT NOT NULL DEFAULT 'n',
+    role_gated INTEGER NOT NULL DEFAULT 0,
+    extra TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (shop, item_id)
+);
+CREATE INDEX IF NOT EXISTS items_item_id ON items (item_id);
+CREATE TABLE IF NOT EXISTS imports (
+    source TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS role_stock (
+    shop TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    role_id TEXT NOT NULL,
+    amount TEXT NOT NULL,
+    PRIMARY KEY (shop, item_id, role_id)
+);
+"""
+
+SQLITE_FILE = "economy.db"
+
+# item keys that have their own column; anything else goes to `extra`
+ITEM_COLUMNS = ("name", "description", "price", "stock", "public_stock", "role_stock")
+
+
+class SqliteBackend(StorageBackend):
+    # the shop JSON files are an import source, they go stale after that
+    shop_files_are_live = False
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn: sqlite3.Connection | None = None
+        self.pending: list[Tuple] = []
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # loading may happen on another thread than the writes,
+            # never both at once (see DiskWorker)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._migrate_inventory(conn)
+            conn.executescript(SQLITE_SCHEMA)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _migrate_inventory(self, conn: sqlite3.Connection):
+        """Databases from before counted inventories had one row per copy."""
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(inventory)")]
+        if "pos" not in columns:
+            return
+        conn.executescript("""
+            ALTER TABLE inventory RENAME TO inventory_old;
+            DROP INDEX IF EXISTS inventory_item;
+            CREATE TABLE inventory (
+                uid TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (uid, item_id)
+            );
+            INSERT INTO inventory (uid, item_id, count)
+                SELECT uid, item_id, COUNT(*) FROM inventory_old GROUP BY uid, item_id;
+            DROP TABLE inventory_old;
+        """)
+
+    # --- loading ---
+
+    def load_store(self, store: JsonStore) -> Dict[str, Any]:
+        if isinstance(store, ShopStore):
+            return self._load_shop(store)
+        return self._load_players(store)
+
+    def _load_players(self, store: JsonStore) -> Dict[str, Any]:
+        imported = self.conn.execute(
+            "SELECT 1 FROM imports WHERE source = ?", (store.path,)
+        ).fetchone()
+        if imported is None:
+            # first run on this database: import players.json
+            players = load_json(store.path, store.fallback)
+            for uid, pdata in players.items():
+                normalize_wallet(pdata)
+                self._write_player(uid, pdata)
+            self.conn.execute("INSERT INTO imports (source) VALUES (?)", (store.path,))
+            self.conn.commit()
+            return players
+
+        players = {}
+        for uid, name, money, extra in self.conn.execute(
+            "SELECT uid, name, money, extra FROM players"
+        ):
+            pdata = json.loads(extra)
+            pdata.update({"name": name, "money": money, "items": {}})
+            players[uid] = pdata
+        for uid, item_id, count in self.conn.execute(
+            "SELECT uid, item_id, count FROM inventory ORDER BY uid, rowid"
+        ):
+            if uid in players:
+                players[uid]["items"][item_id] = count
+        return players
+
+    def _load_shop(self, store: ShopStore) -> Dict[str, Any]:
+        row = self.conn.execute(
+            "SELECT meta FROM shops WHERE shop = ?", (store.path,)
+        ).fetchone()
+        if row is None:
+            # first run on this database: import the JSON file
+            shop_data = load_json(store.path, store.fallback)
+            self._write_shop(store.path, shop_data)
+            self.conn.commit()
+            return shop_data
+
+        shop_data = json.loads(row[0])
+        items: Dict[str, Any] = {}
+        for item_id, name, desc, price, stock, public_stock, role_gated, extra in self.conn.execute(
+            "SELECT item_id, name, description, price, stock, public_stock, role_gated, extra "
+            "FROM items WHERE shop = ? ORDER BY pos",
+            (store.path,)
+        ):
+            item = json.loads(extra)
+            if name is not None:
+                item["name"] = name
+            if desc is not None:
+                item["description"] = desc
+            item.update({
+                "price": price,
+                "stock": stock,
+                "public_stock": public_stock,
+                "role_stock": {} if role_gated else None
+            })
+            items[item_id] = item
+        for item_id, role_id, amount in self.conn.execute(
+            "SELECT item_id, role_id, amount FROM role_stock WHERE shop = ?",
+            (store.path,)
+        ):
+            if item_id in items and items[item_id]["role_stock"] is not None:
+                items[item_id]["role_stock"][role_id] = amount
+        shop_data["items"] = items
+        return shop_data
+
+    # --- writing ---
+
+    def _write_player(self, uid: str, pdata: Dict[str, Any]):
+        """The whole wallet, inventory included (imports and snapshots)."""
+        self._write_player_row(uid, pdata)
+        self.conn.execute("DELETE FROM inventory WHERE uid = ?", (uid,))
+        self.conn.executemany(
+            "INSERT INTO inventory (uid, item_id, count) VALUES (?, ?, ?)",
+            [(uid, item_id, count) for item_id, count in pdata.get("items", {}).items() if count > 0]
+        )
+
+    def _write_player_row(self, uid: str, pdata: Dict[str, Any]):
+        extra = {k: v for k, v in pdata.items() if k not in ("name", "money", "items")}
+        self.conn.execute(
+            "INSERT OR REPLACE INTO players (uid, name, money, extra) VALUES (?, ?, ?, ?)",
+            (uid, pdata.get("name", "Unknown"), int(pdata.get("money", 0)), json.dumps(extra))
+        )
+
+    def _write_wallet_change(self, uid: str, pdata: Dict[str, Any], counts: Dict[str, int]):
+        """The players row plus only the inventory rows that changed."""
+        self._write_player_row(uid, pdata)
+        self.conn.executemany(
+            "INSERT INTO inventory (uid, item_id, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (uid, item_id) DO UPDATE SET count = excluded.count",
+            [(uid, item_id, count) for item_id, count in counts.items() if count > 0]
+        )
+        self.conn.executemany(
+            "DELETE FROM inventory WHERE uid = ? AND item_id = ?",
+            [(uid, item_id) for item_id, count in counts.items() if count <= 0]
+        )
+
+    def _write_item(self, shop_path: str, item_id: str, item: Dict[str, Any], pos: int):
+        extra = {k: v for k, v in item.items() if k not in ITEM_COLUMNS}
+        role_stock = item.get("role_stock", None)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO items "
+            "(shop, item_id, pos, name, description, price, stock, public_stock, role_gated, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                shop_path, item_id, pos,
+                item.get("name"), item.get("description"),
+                int(item.get("price", 0)), str(item.get("stock", "-")),
+                item.get("public_stock", "n"),
+                1 if role_stock is not None else 0,
+                json.dumps(extra)
+            )
+        )
+        self.conn.execute(
+            "DELETE FROM role_stock WHERE shop = ? AND item_id = ?", (shop_path, item_id)
+        )
+        if role_stock:
+            self.conn.executemany(
+                "INSERT INTO role_stock (shop, item_id, role_id, amount) VALUES (?, ?, ?, ?)",
+                [(shop_path, item_id, str(r), str(amt)) for r, amt in role_stock.items()]
+            )
+
+    def _write_shop(self, shop_path: str, shop_data: Dict[str, Any]):
+        meta = {k: v for k, v in shop_data.items() if k != "items"}
+        self.conn.execute(
+            "INSERT OR REPLACE INTO shops (shop, meta) VALUES (?, ?)",
+            (shop_path, json.dumps(meta))
+        )
+        self.conn.execute("DELETE FROM items WHERE shop = ?", (shop_path,))
+        self.conn.execute("DELETE FROM role_stock WHERE shop = ?", (shop_path,))
+        for pos, (item_id, item) in enumerate(shop_data.get("items", {}).items()):
+            self._write_item(shop_path, item_id, item, pos)
+
+    def write_snapshot(self, store: JsonStore, data: Dict[str, Any]):
+        if isinstance(store, ShopStore):
+            self._write_shop(store.path, data)
+        else:
+            self.conn.execute("DELETE FROM players")
+            self.conn.execute("DELETE FROM inventory")
+            for uid, pdata in data.items():
+                self._write_player(uid, pdata)
+        self.conn.commit()
+
+    def record_player(self, uid: str, reason: str, items: Iterable[str] | None = None):
+        pdata = player_store.data[uid]
+        if items is None:
+            self.pending.append((self._write_player, uid, copy_wallet(pdata)))
+            return
+        inv = pdata.get("items") or {}
+        counts = {item_id: inv.get(item_id, 0) for item_id in items}
+        row = {k: v for k, v in pdata.items() if k != "items"}
+        self.pending.append((self._write_wallet_change, uid, row, counts))
+
+    def record_item(self, shop_path: str, item_id: str, reason: str):
+        store = SHOP_STORES[shop_path]
+        pos = list(store.items).index(item_id)
+        self.pending.append((self._write_item, shop_path, item_id, dump_item(store.items[item_id]), pos))
+
+    def take_pending(self) -> list[Tuple]:
+        ops = self.pending
+        self.pending = []
+        return ops
+
+    def apply(self, ops: list[Tuple]):
+        for write, *args in ops:
+            write(*args)
+        self.conn.commit()
+
+    async def commit(self):
+        # always queue a job, even with nothing pending: our changes may be
+        # in a job someone else queued, and jobs finish in order
+        await disk.run(self.apply, self.take_pending())
+
+    def checkpoint_job(self):
+        ops = self.take_pending()
+        snapshots = self.take_snapshots()
+
+        def write():
+            self.apply(ops)
+            self.write_snapshots(snapshots)
+        return write
+
+
+if STORAGE_BACKEND == "sqlite":
+    storage: StorageBackend = SqliteBackend(SQLITE_FILE)
+else:
+    storage = JsonBackend(JOURNAL_FILE)
+
+
+async def load_provision_plan() -> dict:
+    """provisioning.json: category ID -> {member ID -> channel ID}."""
+    return await load_json_async(PROVISION_FILE, {})
+
+async def save_provision_plan(plan: dict):
+    # copy: /confsetup keeps adding channels while this is being written
+    await save_json_async(PROVISION_FILE, {cat: dict(members) for cat, members in plan.items()})
+
+
+# ---------------------------
+# STOCK MODEL
+# ---------------------------
+# On disk stock is a string: "-" for unlimited, otherwise digits, and
+# role_stock maps role IDs (as strings) to the same kind of value.
+# In memory it's parsed once at load: ints, UNLIMITED, role IDs as ints.
+# Everything that needs stock (shop display, availability checks, the
+# actual decrement) goes through the functions below, so they agree.
+
+UNLIMITED = math.inf  # "-" on disk; compares above any int, UNLIMITED - 1 stays UNLIMITED
+
+def parse_stock(value: Any) -> int | float:
+    if value is None or value == "-":
+        return UNLIMITED
+    if isinstance(value, bool):
+        return 0
+    if isinstance(value, int):
+        return max(value, 0)
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    return 0  # anything we can't read is treated as sold out
+
+def dump_stock(value: int | float) -> str:
+    return "-" if value == UNLIMITED else str(int(value))
+
+def parse_item(raw: Dict[str, Any]) -> Dict[str, Any]:
+    item = dict(raw)
+    item["stock"] = parse_stock(raw.get("stock", "-"))
+    role_stock = raw.get("role_stock", None)
+    parsed_roles = None
+    if role_stock:
+        parsed_roles = {}
+        for role_id, amt in role_stock.items():
+            try:
+                parsed_roles[int(role_id)] = parse_stock(amt)
+            except (TypeError, ValueError):
+                # keep it under the raw key: no buyer's role matches it, so the
+                # item stays gated (even if no key is readable) and the entry
+                # is written back as it was for a host to fix
+                print(f"role_stock entry with bad role ID, nobody can buy from it: {role_id!r}")
+                parsed_roles[role_id] = parse_stock(amt)
+    item["role_stock"] = parsed_roles
+    return item
+
+def dump_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    raw = dict(item)
+    raw["stock"] = dump_stock(item.get("stock", UNLIMITED))
+    role_stock = item.get("role_stock", None)
+    if role_stock is not None:
+        raw["role_stock"] = {str(r): dump_stock(amt) for r, amt in role_stock.items()}
+    return raw
+
+def parse_shop(raw: Dict[str, Any]) -> Dict[str, Any]:
+    shop_data = dict(raw)
+    shop_data["items"] = {
+        item_id: parse_item(item) for item_id, item in raw.get("items", {}).items()
+    }
+    return shop_data
+
+def dump_shop(shop_data: Dict[str, Any]) -> Dict[str, Any]:
+    raw = dict(shop_data)
+    raw["items"] = {
+        item_id: dump_item(item) for item_id, item in shop_data.get("items", {}).items()
+    }
+    return raw
+
+def stock_slot(item: Dict[str, Any], buyer_roles: Tuple[int, ...]) -> Tuple[int | None, int | float]:
+    """
+    Which counter a buyer draws from, and how much is left in it.
+    Returns (role_id, amount) for role-gated items - the first of the buyer's
+    roles listed in role_stock that still has stock (or the first listed one,
+    if none has) - and (None, amount) for the global stock.
+    A buyer with none of the listed roles gets (None, 0).
+    """
+    role_stock = item.get("role_stock", None)
+    if role_stock:
+        first_match = None
+        for r in buyer_roles:
+            if r in role_stock:
+                if role_stock[r] > 0:
+                    return (r, role_stock[r])
+                if first_match is None:
+                    first_match = r
+        if first_match is not None:
+            return (first_match, 0)
+        return (None, 0)
+
+    return (None, item.get("stock", UNLIMITED))
+
+def has_stock_for(item: Dict[str, Any], buyer_roles: Tuple[int, ...], qty: int = 1) -> bool:
+    """Check stock availability without mutating anything."""
+    return stock_slot(item, buyer_roles)[1] >= qty
+
+def take_stock(item: Dict[str, Any], buyer_roles: Tuple[int, ...], qty: int = 1) -> bool:
+    """
+    Take qty units from the buyer's counter.
+    Returns False (and changes nothing) if there isn't enough.
+    """
+    role_id, amount = stock_slot(item, buyer_roles)
+    if amount < qty:
+        return False
+    if amount == UNLIMITED:
+        return True
+    if role_id is not None:
+        item["role_stock"][role_id] = amount - qty
+    else:
+        item["stock"] = amount - qty
+    return True
+
+def displayed_stock(item: Dict[str, Any]) -> str:
+    """What the shop message shows for "In Stock"."""
+    if item.get("public_stock", "n") != "y":
+        return "?"
+    role_stock = item.get("role_stock", None)
+    if role_stock:
+        amount = max(role_stock.values())
+    else:
+        amount = item.get("stock", UNLIMITED)
+    return "∞" if amount == UNLIMITED else str(amount)
+
+
+# ---------------------------
+# RENDER CACHE
+# ---------------------------
+# Rendered /wallet texts and shop chunks, keyed by what they show
+# ("wallet", uid) / ("shop", path). Each entry remembers the version it
+# was rendered from (PlayerStore.wallet_revision, ShopStore.revision, ...);
+# a change bumps the version of that one entity, so only its entry gets
+# rebuilt on the next view. Least recently used entries go first.
+
+class RenderCache:
+    def __init__(self, size: int):
+        self.size = size
+        self.entries: OrderedDict = OrderedDict()  # key -> (version, rendered)
+
+    def get_or_build(self, key: Tuple, version: Any, build):
+        hit = self.entries.get(key)
+        if hit is not None and hit[0] == version:
+            self.entries.move_to_end(key)
+            metrics.inc("render_cache_hits")
+            return hit[1]
+
+        metrics.inc("render_cache_misses")
+        rendered = build()
+        self.entries[key] = (version, rendered)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return rendered
+
+
+render_cache = RenderCache(RENDER_CACHE_SIZE)
+
+
+# ---------------------------
+# SHOP RENDERING
+# ---------------------------
+
+SHOP_MESSAGE_LIMIT = 2000  # Discord's max message length
+
+def build_shop_blocks(shop_data: Dict[str, Any], shop_label: str | None = None) -> list[str]:
+    """
+    Turn the JSON for a shop into the ordered pieces of the shop text
+    (header, one block per item, footer).
+    shop_data: loaded JSON for this shop.
+    shop_label: fallback label if shop_data doesn't include 'title'.
+    """
+    # title & intro customizable in the JSON
+    title = shop_data.get("title") or (shop_label or "Shop")
+    intro = shop_data.get("intro") or "Willkommen. Alles hat einen Preis."
+
+    lines = []
+    lines.append(f"**{title}**")
+
+    if shop_data.get("open", True) is False:
+        lines.append("*Closed right now. Come back later.*")
+        return lines
+
+    lines.append(intro + "\n")
+
+    for item_id, item in shop_data.get("items", {}).items():
+        name = item.get("name", "???")
+        desc = item.get("description", "")
+        price = item.get("price", 0)
+        shown_stock = displayed_stock(item)
+
+        lines.append(
+            f"**{name}**  (`{item_id}`)\n"
+            f"{desc}\n"
+            f"Price: {price} DM | In Stock: {shown_stock}\n"
+        )
+
+    # footer (optional)
+    lines.append("\n*Use `/buy` or `!buy <itemID> [quantity]` to purchase, or list several IDs after `!buy` to buy them together.*")
+    return lines
+
+def build_shop_message(shop_data: Dict[str, Any], shop_label: str | None = None) -> str:
+    """
+    The whole shop as one string (may be longer than one Discord message).
+    """
+    return "\n".join(build_shop_blocks(shop_data, shop_label))
+
+def build_shop_chunks(shop_data: Dict[str, Any], shop_label: str | None = None) -> list[str]:
+    """
+    The shop split into messages of at most SHOP_MESSAGE_LIMIT characters.
+    Blocks are never split across messages; a single block that is too long
+    on its own gets cut off.
+    """
+    chunks = []
+    current = ""
+    for block in build_shop_blocks(shop_data, shop_label):
+        if len(block) > SHOP_MESSAGE_LIMIT:
+            block = block[:SHOP_MESSAGE_LIMIT - 1] + "…"
+        if current and len(current) + 1 + len(block) > SHOP_MESSAGE_LIMIT:
+            chunks.append(current)
+            current = block
+        elif current:
+            current = current + "\n" + block
+        else:
+            current = block
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def render_shop_chunks(store: ShopStore) -> list[str]:
+    """build_shop_chunks for a store, cached until the shop changes."""
+    return render_cache.get_or_build(
+        ("shop", store.path),
+        store.revision,
+        lambda: build_shop_chunks(store.data, store.label)
+    )
+
+
+async def get_last_bot_message(channel: discord.TextChannel, bot_user: discord.User):
+    """
+    Return (message or None) for the most recent message in channel that is either:
+    - the last message in channel at all, if it's from the bot
+    - else None
+    """
+    async for msg in channel.history(limit=1):
+        if msg.author.id == bot_user.id:
+            return msg
+        else:
+            return None
+    return None
+
+
+async def delete_messages_by_id(channel: discord.TextChannel, message_ids: list[int]):
+    for mid in message_ids:
+        try:
+            await channel.get_partial_message(mid).delete()
+        except discord.NotFound:
+            pass
+
+async def sync_shop_channel(bot: commands.Bot, shop_path: str):
+    """
+    Ensure the shop messages in that channel match the in-memory shop.
+    The shop is rendered into one or more chunks (see build_shop_chunks);
+    each chunk has its own message and only chunks whose text changed
+    get edited. Creates/deletes messages when the chunk count changes.
+    Skips Discord entirely if nothing changed since last time.
+    The message IDs are kept in the shop JSON ("message_ids") so we can
+    edit them directly, next to a hash of what each one shows
+    ("message_hashes") so a restart doesn't re-edit unchanged messages.
+    Channel history is only checked if we have no IDs at all (shops
+    posted by older versions of the bot).
+    """
+    store = SHOP_STORES[shop_path]
+    shop_data = store.data
+    channel_id = shop_data.get("channel_id", 0)
+    if channel_id == 0:
+        return  # shop not configured yet
+
+    channel = bot.get_channel(channel_id)
+    if channel is None:
+        return  # channel doesn't exist / bot can't see it
+
+    chunks = render_shop_chunks(store)
+    hashes = [
+        hashlib.sha1(f"{channel_id}\n{chunk}".encode("utf-8")).hexdigest()
+        for chunk in chunks
+    ]
+    old_ids = list(shop_data.get("message_ids") or [])
+    old_hashes = list(shop_data.get("message_hashes") or []) if old_ids else []
+    if old_hashes == hashes and len(old_ids) == len(hashes):
+        metrics.inc("shop_edits_skipped", len(hashes))
+        return
+
+    if not old_ids:
+        last_bot_msg = await get_last_bot_message(channel, bot.user)
+        if last_bot_msg is not None:
+            old_ids = [last_bot_msg.id]
+
+    new_ids = []
+    try:
+        for i, chunk in enumerate(chunks):
+            if i < len(old_ids):
+                if i < len(old_hashes) and old_hashes[i] == hashes[i]:
+                    new_ids.append(old_ids[i])
+                    metrics.inc("shop_edits_skipped")
+                    continue
+                try:
+                    await channel.get_partial_message(old_ids[i]).edit(content=chunk)
+                    metrics.inc("shop_edits")
+                    new_ids.append(old_ids[i])
+                    continue
+                except (discord.NotFound, discord.Forbidden):
+                    # gone (or not ours anymore): everything after it has to be
+                    # re-posted too, or the shop would end up out of order
+                    await delete_messages_by_id(channel, old_ids[i + 1:])
+                    old_ids = old_ids[:i]
+
+            msg = await channel.send(chunk)
+            metrics.inc("shop_edits")
+            new_ids.append(msg.id)
+
+        # the shop got shorter
+        await delete_messages_by_id(channel, old_ids[len(chunks):])
+    finally:
+        # remember what we posted even if Discord failed halfway; messages
+        # we didn't get to still show what they showed before
+        kept_ids = new_ids + old_ids[len(new_ids):len(chunks)]
+        kept_hashes = hashes[:len(new_ids)] + old_hashes[len(new_ids):len(kept_ids)]
+        if (
+            kept_ids != (shop_data.get("message_ids") or [])
+            or kept_hashes != (shop_data.get("message_hashes") or [])
+        ):
+            shop_data["message_ids"] = kept_ids
+            shop_data["message_hashes"] = kept_hashes
+            store.mark_dirty()
+
+
+SHOP_SYNC_WINDOW = 1.5  # seconds; every change inside one window shares one edit
+
+
+class ShopSyncScheduler:
+    """
+    Coalesces shop refreshes. mark_dirty() only flags the shop that changed;
+    one task per shop waits SHOP_SYNC_WINDOW and then syncs once, no matter
+    how many purchases happened in between.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.dirty: set[str] = set()
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    def mark_dirty(self, shop_path: str):
+        self.dirty.add(shop_path)
+        task = self.tasks.get(shop_path)
+        if task is None or task.done():
+            self.tasks[shop_path] = asyncio.get_running_loop().create_task(self._run(shop_path))
+
+    async def _run(self, shop_path: str):
+        # loop, because the shop can change again while we're talking to Discord
+        while shop_path in self.dirty:
+            await asyncio.sleep(SHOP_SYNC_WINDOW)
+            self.dirty.discard(shop_path)
+            try:
+                await sync_shop_channel(self.bot, shop_path)
+            except discord.HTTPException as e:
+                print(f"Shop sync for {shop_path} failed: {e}")
+
+
+# ---------------------------
+# SHOP FILE WATCHER
+# ---------------------------
+# Hosts edit kaufhaus.json / schwartzmarkt.json by hand. We poll their
+# mtime/size; when a file changed (and then stayed unchanged for one more
+# poll, so we don't read half-saved files) it's validated and swapped in.
+# Broken edits are reported to the hosts and the shop keeps running
+# on what it had.
+
+SHOP_WATCH_INTERVAL = 5.0  # seconds between checks of the shop files
+
+def validate_shop(raw: Any) -> list[str]:
+    """Everything wrong with a shop file, empty list if it's fine."""
+    if not isinstance(raw, dict):
+        return ["the file must contain a JSON object"]
+
+    problems = []
+    if not isinstance(raw.get("channel_id", 0), int):
+        problems.append("`channel_id` must be a number")
+    if not isinstance(raw.get("open", True), bool):
+        problems.append("`open` must be true or false")
+
+    items = raw.get("items", {})
+    if not isinstance(items, dict):
+        return problems + ["`items` must be an object"]
+
+    def stock_ok(value: Any) -> bool:
+        if value == "-" or value is None:
+            return True
+        if isinstance(value, bool):
+            return False
+        if isinstance(value, int):
+            return value >= 0
+        return isinstance(value, str) and value.isdigit()
+
+    for item_id, item in items.items():
+        if not isinstance(item, dict):
+            problems.append(f"`{item_id}` must be an object")
+            continue
+        price = item.get("price", 0)
+        if isinstance(price, bool) or not isinstance(price, int) or price < 0:
+            problems.append(f"`{item_id}`: price must be a whole number >= 0")
+        if not stock_ok(item.get("stock", "-")):
+            problems.append(f"`{item_id}`: stock must be \"-\" or a whole number >= 0")
+        role_stock = item.get("role_stock", None)
+        if role_stock is not None:
+            if not isinstance(role_stock, dict):
+                problems.append(f"`{item_id}`: role_stock must be an object or null")
+                continue
+            for role_id, amt in role_stock.items():
+                if not str(role_id).isdigit():
+                    problems.append(f"`{item_id}`: role_stock key `{role_id}` is not a role ID")
+                elif not stock_ok(amt):
+                    problems.append(f"`{item_id}`: role_stock for `{role_id}` must be \"-\" or a whole number >= 0")
+    return problems
+
+async def notify_hosts(bot: commands.Bot, text: str):
+    """Post a warning to HOST_CHANNEL_ID (console only if that's not set)."""
+    print(text)
+    if HOST_CHANNEL_ID == 0:
+        return
+    channel = bot.get_channel(HOST_CHANNEL_ID)
+    if channel is None:
+        return
+    try:
+        await channel.send(text[:SHOP_MESSAGE_LIMIT])
+    except discord.HTTPException as e:
+        print(f"Couldn't warn hosts: {e}")
+
+async def reload_shop_file(store: ShopStore) -> list[str]:
+    """
+    Read the shop file again and swap it in if it's valid.
+    Returns the problems if it isn't (and leaves the shop alone).
+    """
+    try:
+        raw = await disk.run(read_json_file, store.path)
+    except (OSError, json.JSONDecodeError) as e:
+        return [f"can't read it as JSON: {e}"]
+
+    problems = validate_shop(raw)
+    if problems:
+        return problems
+
+    # the bot owns message_ids/message_hashes; keep ours if the edit dropped them
+    for key in ("message_ids", "message_hashes"):
+        if key not in raw and key in store.data:
+            raw[key] = store.data[key]
+
+    # one assignment, nothing can see a half-updated shop
+    store.data = store.parse(raw)
+    store.items_changed()
+    storage.shop_file_replaced(store)
+    # the journal may still hold entries for the old items; snapshot now
+    # so a replay can't undo the edit
+    await flush_all_async()
+    return []
+
+async def watch_shop_files(bot: commands.Bot):
+    await bot.wait_until_ready()
+    seen: Dict[str, Tuple[int, int] | None] = {}
+
+    while not bot.is_closed():
+        await asyncio.sleep(SHOP_WATCH_INTERVAL)
+        for path, store in SHOP_STORES.items():
+            stamp = get_file_stamp(path)
+            if stamp is None or stamp == store.file_stamp:
+                seen.pop(path, None)
+                continue
+            if seen.get(path) != stamp:
+                # changed since last poll, wait until it settles
+                seen[path] = stamp
+                continue
+
+            seen.pop(path, None)
+            store.file_stamp = stamp
+            problems = await reload_shop_file(store)
+            if problems:
+                await notify_hosts(
+                    bot,
+                    f"⚠️ Ignored the edit to `{path}`, the shop keeps its previous contents:\n"
+                    + "\n".join(f"- {p}" for p in problems[:15])
+                )
+                continue
+
+            print(f"Reloaded {path}.")
+            shop_sync.mark_dirty(path)
+
+
+# ---------------------------
+# ITEM CATALOG
+# ---------------------------
+
+class CatalogIndex:
+    """
+    item id -> (which_file, item_dict) across both shops.
+    Rebuilt lazily when a shop's layout_version moved (items added,
+    removed or replaced); stock and price changes don't need a rebuild
+    because the index points at the live item dicts.
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        self.duplicates: Dict[str, list[str]] = {}
+        # sorted search keys (lowercase ID, name, words of the name) and the
+        # item ID each one belongs to, for prefix lookups with bisect
+        self.search_keys: list[str] = []
+        self.search_ids: list[str] = []
+        self._versions: Tuple[int, ...] | None = None
+
+    def refresh(self):
+        versions = tuple(store.layout_version for store in SHOP_STORES.values())
+        if versions == self._versions:
+            return
+
+        entries = {}
+        duplicates = {}
+        for path, store in SHOP_STORES.items():
+            for item_id, item in store.items.items():
+                if item_id in entries:
+                    # first shop wins, same as the old file-by-file lookup
+                    duplicates.setdefault(item_id, [entries[item_id][0]]).append(path)
+                    continue
+                entries[item_id] = (path, item)
+
+        if duplicates and duplicates != self.duplicates:
+            for item_id, paths in duplicates.items():
+                print(f"Item ID '{item_id}' exists in {', '.join(paths)}; using the one in {paths[0]}.")
+
+        keys = set()
+        for item_id, (_, item) in entries.items():
+            name = str(item.get("name") or "").lower()
+            keys.add((item_id.lower(), item_id))
+            if name:
+                keys.add((name, item_id))
+                for word in name.split()[1:]:
+                    keys.add((word, item_id))
+        keys = sorted(keys)
+
+        self.entries = entries
+        self.duplicates = duplicates
+        self.search_keys = [key for key, _ in keys]
+        self.search_ids = [item_id for _, item_id in keys]
+        self._versions = versions
+
+    def get(self, item_id: str) -> Tuple[str, Dict[str, Any]] | None:
+        self.refresh()
+        return self.entries.get(item_id)
+
+    @property
+    def version(self) -> Tuple[int, ...]:
+        """Changes whenever an item is added, removed or renamed."""
+        self.refresh()
+        return self._versions
+
+    def search(self, prefix: str):
+        """
+        Yield (item_id, which_file, item_dict) for items whose ID, name, or
+        any word of the name starts with prefix (case-insensitive), each item once.
+        """
+        self.refresh()
+        prefix = prefix.lower()
+        seen = set()
+        start = bisect.bisect_left(self.search_keys, prefix)
+        for i in range(start, len(self.search_keys)):
+            if not self.search_keys[i].startswith(prefix):
+                break
+            item_id = self.search_ids[i]
+            if item_id not in seen:
+                seen.add(item_id)
+                yield (item_id, *self.entries[item_id])
+
+
+catalog = CatalogIndex()
+
+
+# ---------------------------
+# ECONOMY / BUY LOGIC
+# ---------------------------
+
+def find_item_in_shops(item_id: str) -> Tuple[str, Dict[str, Any]] | None:
+    """
+    Look for item_id in kaufhaus first, then schwartzmarkt.
+    Return (which_file, item_dict) or None.
+    item_dict is the live in-memory record, not a copy.
+    """
+    return catalog.get(item_id)
+
+def user_can_afford(user_id: int, cost: int) -> bool:
+    players = load_players()
+    pdata = players.get(str(user_id), {"money": 0, "items": {}, "name": "Unknown"})
+    return pdata.get("money", 0) >= cost
+
+def deduct_money_and_give_items(user_id: int, cart: Dict[str, int], cost: int, member_obj: discord.Member | None):
+    """
+    Charge the player, add the items (item ID -> quantity) to their inventory,
+    and keep their name synced.
+    member_obj is the discord.Member who bought it (so we can keep name up to date).
+    """
+    players = load_players()
+    uid = str(user_id)
+
+    if uid not in players:
+        # create new if somehow missing
+        players[uid] = {
+            "name": member_obj.display_name if member_obj else "Unknown",
+            "money": 0,
+            "items": {}
+        }
+
+    pdata = players[uid]
+
+    # sync the stored name with their current display
+    if member_obj and pdata.get("name") != member_obj.display_name:
+        pdata["name"] = member_obj.display_name
+
+    # deduct
+    current_money = pdata.get("money", 0)
+    pdata["money"] = current_money - cost
+    if pdata["money"] < 0:
+        pdata["money"] = 0  # safety, shouldn't really go below
+
+    # add items
+    inv = pdata.setdefault("items", {})
+    for item_id, qty in cart.items():
+        inv[item_id] = inv.get(item_id, 0) + qty
+
+    players[uid] = pdata
+    player_store.wallet_changed(uid, "buy", cart)
+
+def reduce_stock(which_file: str, item_id: str, buyer_roles: Tuple[int, ...], qty: int = 1) -> bool:
+    """
+    Returns True if stock was successfully reduced by qty (or unlimited)
+    Returns False if there isn't that much.
+    Journals the item if a counter actually changed.
+    """
+    store = SHOP_STORES[which_file]
+    item = store.items[item_id]
+
+    before = stock_slot(item, buyer_roles)
+    if not take_stock(item, buyer_roles, qty):
+        return False
+    if before[1] != UNLIMITED:
+        store.item_changed(item_id, "stock")
+    return True
+
+
+# ---------------------------
+# PURCHASE TRANSACTIONS
+# ---------------------------
+# A purchase holds the lock for its item and the lock for the buyer's wallet
+# from the stock check until the change is made in memory and recorded. Two
+# people racing for the last idol queue up on the item lock; purchases of
+# different items by different players don't wait on each other at all.
+# Waiting for the change to be durable happens after the locks are released,
+# so a rush on one item shares group commits instead of queueing up on them.
+
+class PurchaseError(Exception):
+    """A purchase was refused. str(e) is what we tell the buyer."""
+
+
+class KeyedLocks:
+    """
+    One asyncio.Lock per key (item id, wallet id), created on demand.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def get(self, key: str) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    @contextlib.asynccontextmanager
+    async def hold(self, *keys: str):
+        """
+        Acquire the locks for all keys. Sorted order, so two callers
+        asking for overlapping keys can't deadlock each other.
+        """
+        locks = [self.get(k) for k in sorted(set(keys))]
+        acquired = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+
+item_locks = KeyedLocks()
+wallet_locks = KeyedLocks()
+
+def parse_cart(args: Tuple[str, ...]) -> Dict[str, int]:
+    """
+    Arguments of !buy -> item ID -> quantity, in the order given.
+    A number after an item ID is its quantity (`!buy idol 2`), an ID
+    given twice counts twice (`!buy idol idol`).
+    """
+    cart: Dict[str, int] = {}
+    last = None
+    for arg in args:
+        if arg.isdigit() and last is not None:
+            qty = int(arg)
+            if qty < 1:
+                raise PurchaseError("Quantities start at 1.")
+            # the item was already counted once when its ID came up
+            cart[last] += qty - 1
+            last = None
+            continue
+        if arg.isdigit():
+            raise PurchaseError(f"`{arg}` isn't an item ID. Put quantities after the item: `!buy <itemID> <quantity>`.")
+        cart[arg] = cart.get(arg, 0) + 1
+        last = arg
+    return cart
+
+async def purchase_items(buyer: discord.Member, cart: Dict[str, int]) -> list[Tuple[str, str, Dict[str, Any], int]]:
+    """
+    Buy everything in the cart (item ID -> quantity) as one unit: either the
+    buyer can afford all of it and every item has enough stock for them,
+    or nothing changes. Always take item locks before wallet locks.
+    Returns [(which_file, item_id, item_dict, qty)] or raises PurchaseError.
+    """
+    buyer_roles = tuple([r.id for r in buyer.roles if not r.is_default()])
+
+    missing = [item_id for item_id in cart if find_item_in_shops(item_id) is None]
+    if missing:
+        raise PurchaseError(
+            "That item doesn't exist." if len(cart) == 1
+            else "These items don't exist: " + ", ".join(f"`{i}`" for i in missing)
+        )
+
+    async with item_locks.hold(*cart), wallet_locks.hold(str(buyer.id)):
+        # look again under the locks, the shops may have changed while we waited
+        lines = []
+        for item_id, qty in cart.items():
+            res = find_item_in_shops(item_id)
+            if res is None:
+                raise PurchaseError(f"`{item_id}` doesn't exist (anymore).")
+            which_file, item_data = res
+            if not SHOP_STORES[which_file].is_open:
+                raise PurchaseError(f"The {SHOP_STORES[which_file].label} is closed right now.")
+            if not has_stock_for(item_data, buyer_roles, qty):
+                name = item_data.get("name", item_id)
+                if qty == 1:
+                    raise PurchaseError(
+                        "That item is sold out for you." if len(cart) == 1
+                        else f"**{name}** is sold out for you."
+                    )
+                raise PurchaseError(f"There aren't {qty} of **{name}** left for you.")
+            lines.append((which_file, item_id, item_data, qty))
+
+        cost = sum(int(item_data.get("price", 0)) * qty for _, _, item_data, qty in lines)
+        if not user_can_afford(buyer.id, cost):
+            raise PurchaseError(
+                "You don't have enough Deutsche Marks." if len(lines) == 1 and lines[0][3] == 1
+                else f"You don't have enough Deutsche Marks (that's {cost} DM in total)."
+            )
+
+        # nothing between here and the end of the block yields, so the
+        # checks above still hold
+        for which_file, item_id, item_data, qty in lines:
+            if not reduce_stock(which_file, item_id, buyer_roles, qty):
+                raise PurchaseError("That item is sold out for you.")
+        deduct_money_and_give_items(buyer.id, cart, cost, buyer)
+
+    # outside the locks: a failed commit wouldn't undo the change in memory
+    # anyway, and the next buyer can already record theirs into the same commit
+    await storage.commit()
+
+    return lines
+
+async def purchase_item(buyer: discord.Member, item_id: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    One unit of one item, see purchase_items.
+    Returns (which_file, item_dict) or raises PurchaseError.
+    """
+    (which_file, _, item_data, _), = await purchase_items(buyer, {item_id: 1})
+    return which_file, item_data
+
+def format_purchase_announcement(buyer: discord.Member, lines: list[Tuple[str, str, Dict[str, Any], int]]) -> str:
+    bought = []
+    for _, item_id, item_data, qty in lines:
+        item_name = item_data.get("name", item_id)
+        bought.append(f"**{item_name}**" if qty == 1 else f"**{qty}× {item_name}**")
+    return f"Congratulations, {buyer.mention}! You just bought {', '.join(bought)}."
+
+
+# ---------------------------
+# ANNOUNCEMENTS
+# ---------------------------
+# Purchase announcements don't go out from the command itself. When a
+# channel has been quiet for ANNOUNCE_WINDOW the announcement is sent right
+# away; everything that comes in during the window after that gets folded
+# into one digest at the end of it. So a channel gets at most one
+# announcement message per window, the hosts at most one ping per window,
+# and a command never waits on (or behind) a rate-limited send.
+
+class AnnouncementQueue:
+    def __init__(self):
+        self.pending: Dict[int, list[str]] = {}  # channel ID -> lines for the next digest
+        self.last_sent: Dict[int, float] = {}  # channel ID -> monotonic time of the last send
+        self.last_ping = -math.inf
+        self.digests: Dict[int, asyncio.Task] = {}  # channel ID -> task waiting out the window
+        self.sends: set[asyncio.Task] = set()
+
+    def announce(self, channel: discord.abc.Messageable, line: str):
+        metrics.inc("announcements")
+        now = time.monotonic()
+        channel_id = channel.id
+        if channel_id in self.pending:
+            self.pending[channel_id].append(line)
+            return
+
+        since_last = now - self.last_sent.get(channel_id, -math.inf)
+        if since_last >= ANNOUNCE_WINDOW:
+            # quiet channel: straight out
+            self.last_sent[channel_id] = now
+            task = asyncio.get_running_loop().create_task(self._send(channel, [line]))
+            self.sends.add(task)
+            task.add_done_callback(self.sends.discard)
+            return
+
+        self.pending[channel_id] = [line]
+        self.digests[channel_id] = asyncio.get_running_loop().create_task(
+            self._send_digest_later(channel, ANNOUNCE_WINDOW - since_last)
+        )
+
+    async def _send_digest_later(self, channel: discord.abc.Messageable, delay: float):
+        await asyncio.sleep(delay)
+        self.digests.pop(channel.id, None)
+        lines = self.pending.pop(channel.id, [])
+        self.last_sent[channel.id] = time.monotonic()
+        await self._send(channel, lines)
+
+    async def _send(self, channel: discord.abc.Messageable, lines: list[str]):
+        if not lines:
+            return
+        if len(lines) == 1:
+            text = lines[0]
+        else:
+            text = f"**{len(lines)} purchases:**\n" + "\n".join(lines)
+
+        now = time.monotonic()
+        if now - self.last_ping >= ANNOUNCE_WINDOW:
+            self.last_ping = now
+            text += f" ||{HOST_PING}||"
+
+        # a huge digest may not fit into one message
+        while text:
+            cut = len(text)
+            if cut > SHOP_MESSAGE_LIMIT:
+                cut = text.rfind("\n", 0, SHOP_MESSAGE_LIMIT)
+                if cut <= 0:
+                    cut = SHOP_MESSAGE_LIMIT
+            part, text = text[:cut], text[cut:].lstrip("\n")
+            try:
+                await channel.send(part)
+                metrics.inc("announcement_messages")
+            except discord.HTTPException as e:
+                print(f"Couldn't send purchase announcement: {e}")
+                return
+
+    async def drain(self):
+        """Send whatever is still waiting, now (shutdown)."""
+        for task in self.digests.values():
+            task.cancel()
+        self.digests.clear()
+        for channel_id, lines in list(self.pending.items()):
+            channel = bot.get_channel(channel_id)
+            if channel is not None:
+                await self._send(channel, lines)
+        self.pending.clear()
+        if self.sends:
+            await asyncio.gather(*self.sends, return_exceptions=True)
+
+
+announcements = AnnouncementQueue()
+
+# ---------------------------
+# Creating Wallets
+# ---------------------------
+
+def load_players() -> dict:
+    """Return the live players dict (ID -> wallet info)."""
+    return player_store.data
+
+def save_players(players: dict):
+    """Replace the whole players dict and schedule a snapshot of players.json."""
+    player_store.data = players
+    player_store.generation += 1
+    player_store.mark_dirty()
+
+def ensure_player_entry(user: discord.Member, players: dict) -> bool:
+    """
+    Make sure this user exists in players.json.
+    If they don't, create them with name/money/items.
+    If they DO exist, update the stored name in case it changed.
+    Returns True if this was a NEW entry (not previously there),
+    False if it already existed.
+    """
+    uid = str(user.id)
+    display = user.display_name
+
+    if uid not in players:
+        players[uid] = {
+            "name": display,
+            "money": 0,
+            "items": {}
+        }
+        return True
+    else:
+        # update name if it's different
+        if players[uid].get("name") != display:
+            players[uid]["name"] = display
+        # leave money/items alone
+        return False
+
+def get_user_wallet_dict(user_id: int) -> dict:
+    """
+    Return a dict with {name, money, items}.
+    If the user isn't in players.json yet, we fabricate a temp zero wallet.
+    We DON'T save that temp wallet here; saving/creation is handled elsewhere.
+    """
+    players = load_players()
+    entry = players.get(str(user_id))
+
+    if entry is None:
+        # fabricate a blank preview
+        return {
+            "name": "Unknown",
+            "money": 0,
+            "items": {}
+        }
+
+    return {
+        "name": entry.get("name", "Unknown"),
+        "money": entry.get("money", 0),
+        "items": entry.get("items", {})
+    }
+
+def resolve_item_name(item_id: str) -> str:
+    """
+    Look up a prettier name for an itemID by checking kaufhaus or schwartzmarkt.
+    Fall back to the raw ID if not found.
+    """
+    res = find_item_in_shops(item_id)
+    if res is None:
+        return item_id
+    return res[1].get("name", item_id)
+
+def format_wallet_message(user: discord.Member) -> str:
+    """
+    The string we show in /wallet. Cached until the wallet, an item name
+    or the member's display name changes.
+    """
+    version = (player_store.wallet_revision(str(user.id)), catalog.version, user.display_name)
+    return render_cache.get_or_build(
+        ("wallet", str(user.id)),
+        version,
+        lambda: build_wallet_message(user)
+    )
+
+def build_wallet_message(user: discord.Member) -> str:
+    w = get_user_wallet_dict(user.id)
+    money = w["money"]
+    item_counts = {i: n for i, n in w["items"].items() if n > 0}
+
+    if item_counts:
+        pretty_items = [
+            f"{resolve_item_name(i)} (`{i}`)" + (f" ×{n}" if n > 1 else "")
+            for i, n in item_counts.items()
+        ]
+        items_str = "\n".join(f"- {x}" for x in pretty_items)
+    else:
+        items_str = "No items."
+
+    msg = (
+        f"Wallet for **{user.display_name}** "
+        f"(stored as \"{w['name']}\"):\n"
+        f"Money: {money} DM\n"
+        f"Items:\n{items_str}"
+    )
+    return msg
+
+def is_host(member: discord.Member) -> bool:
+    """
+    Host permissions check.
+    You can tweak this however you want (host role, admin, etc.).
+    """
+    if member.guild_permissions.administrator:
+        return True
+    for r in member.roles:
+        if r.id == HOST_ROLE_ID:
+            return True
+    return False
+
+# ---------------------------
+# BATCH ECONOMY CHANGES
+# ---------------------------
+
+MEMBER_ID_RE = re.compile(r"\d{15,21}")
+
+async def collect_batch_targets(
+    guild: discord.Guild,
+    user: discord.Member | None,
+    role: discord.Role | None,
+    members: str | None,
+    everyone: bool
+) -> Dict[str, discord.Member | None]:
+    """
+    Everyone a batch command should hit, as uid -> Member.
+    members: free text with mentions and/or raw IDs.
+    everyone: every wallet in players.json (Member is None for people
+    we don't have cached; their stored name is left alone).
+    """
+    targets: Dict[str, discord.Member | None] = {}
+
+    if everyone:
+        for uid in load_players():
+            targets[uid] = guild.get_member(int(uid)) if uid.isdigit() else None
+
+    if user is not None:
+        targets[str(user.id)] = user
+
+    if role is not None:
+        for m in await fetch_role_members(guild, role):
+            targets[str(m.id)] = m
+
+    if members:
+        for raw_id in MEMBER_ID_RE.findall(members):
+            m = guild.get_member(int(raw_id))
+            if m is None:
+                try:
+                    m = await guild.fetch_member(int(raw_id))
+                except discord.NotFound:
+                    continue  # not in this server
+            targets[raw_id] = m
+
+    return targets
+
+async def apply_batch(
+    targets: Dict[str, discord.Member | None],
+    money: int,
+    item_id: str | None,
+    quantity: int,
+    reason: str
+) -> int:
+    """
+    Add money and/or copies of an item to every target wallet (negative
+    numbers take away) as one change: all wallets are locked together,
+    every wallet gets its journal entry and there is a single commit.
+    Missing wallets are created. Nothing goes below zero.
+    Returns how many wallets didn't have enough of what was taken.
+    """
+    players = load_players()
+    short = 0
+
+    async with wallet_locks.hold(*targets):
+        for uid, member in targets.items():
+            if member is not None:
+                ensure_player_entry(member, players)
+            elif uid not in players:
+                continue
+            pdata = players[uid]
+
+            was_short = False
+            if money:
+                new_money = pdata.get("money", 0) + money
+                if new_money < 0:
+                    was_short = True
+                    new_money = 0
+                pdata["money"] = new_money
+
+            if item_id is not None and quantity:
+                inv = pdata.setdefault("items", {})
+                new_count = inv.get(item_id, 0) + quantity
+                if new_count < 0:
+                    was_short = True
+                    new_count = 0
+                if new_count:
+                    inv[item_id] = new_count
+                else:
+                    inv.pop(item_id, None)
+
+            if was_short:
+                short += 1
+            player_store.wallet_changed(uid, reason, () if item_id is None else (item_id,))
+
+    # outside the locks, like purchases: a big role shouldn't keep its
+    # members from buying for the length of a commit
+    await storage.commit()
+
+    return short
+
+
+# ---------------------------
+# SCHEDULED SHOP EVENTS
+# ---------------------------
+# Timed changes hosts set up with /schedule: restock an item, change its
+# price, open or close a shop. Kept in schedule.json so they survive
+# restarts (anything that came due while the bot was down runs right after
+# startup). One task sleeps until the earliest event; adding an earlier one
+# wakes it up. Events change the shops the same way purchases do (item
+# locks, journal, one shop sync) and are idempotent, so running one twice
+# after a crash does no harm.
+
+SCHEDULE_KINDS = ("restock", "price", "open", "close")
+
+
+def parse_when(text: str) -> float:
+    """
+    "+30m", "2h", "1d12h" (from now) or "2025-11-01 20:00" (UTC unless
+    an offset is given) -> unix timestamp. Raises ValueError.
+    """
+    text = text.strip()
+    relative = text.lstrip("+").replace(" ", "")
+    if relative and re.fullmatch(r"(\d+[smhd])+", relative):
+        unit_seconds = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+        delta = sum(
+            int(n) * unit_seconds[unit]
+            for n, unit in re.findall(r"(\d+)([smhd])", relative)
+        )
+        return time.time() + delta
+
+    when = datetime.fromisoformat(text)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.timestamp()
+
+def describe_event(event: Dict[str, Any]) -> str:
+    store = SHOP_STORES.get(event["shop"])
+    shop = store.label if store else event["shop"]
+    kind = event["kind"]
+    if kind == "restock":
+        amount = "unlimited" if event["value"] == "-" else event["value"]
+        return f"restock `{event['item_id']}` in {shop} to {amount}"
+    if kind == "price":
+        return f"set the price of `{event['item_id']}` in {shop} to {event['value']} DM"
+    return f"{kind} the {shop}"
+
+
+class ShopScheduler:
+    def __init__(self):
+        self.heap: list[Tuple[float, int, Dict[str, Any]]] = []  # (at, id, event)
+        self.next_id = 1
+        self.wakeup: asyncio.Event | None = None
+
+    def load(self):
+        data = load_json(SCHEDULE_FILE, {"next_id": 1, "events": []})
+        self.next_id = data.get("next_id", 1)
+        self.heap = [(event["at"], event["id"], event) for event in data.get("events", [])]
+        heapq.heapify(self.heap)
+
+    async def save(self):
+        events = [dict(event) for _, _, event in sorted(self.heap)]
+        await save_json_async(SCHEDULE_FILE, {"next_id": self.next_id, "events": events})
+
+    def upcoming(self) -> list[Dict[str, Any]]:
+        return [event for _, _, event in sorted(self.heap)]
+
+    def _wake(self):
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def add(
+        self,
+        at: float,
+        shop: str,
+        kind: str,
+        item_id: str | None,
+        value: str | None,
+        created_by: int
+    ) -> Dict[str, Any]:
+        event = {
+            "id": self.next_id,
+            "at": at,
+            "shop": shop,
+            "kind": kind,
+            "item_id": item_id,
+            "value": value,
+            "created_by": created_by
+        }
+        self.next_id += 1
+        heapq.heappush(self.heap, (at, event["id"], event))
+        await self.save()
+        self._wake()
+        return event
+
+    async def cancel(self, event_id: int) -> Dict[str, Any] | None:
+        for i, (_, eid, event) in enumerate(self.heap):
+            if eid == event_id:
+                self.heap.pop(i)
+                heapq.heapify(self.heap)
+                await self.save()
+                self._wake()
+                return event
+        return None
+
+    async def run(self, bot: commands.Bot):
+        self.wakeup = asyncio.Event()
+        await bot.wait_until_ready()
+
+        while not bot.is_closed():
+            self.wakeup.clear()
+            if self.heap and self.heap[0][0] <= time.time():
+                _, _, event = heapq.heappop(self.heap)
+                try:
+                    await apply_scheduled_event(bot, event)
+                except Exception as e:
+                    await notify_hosts(bot, f"⚠️ Scheduled event #{event['id']} ({describe_event(event)}) failed: {e}")
+                await self.save()
+                continue
+
+            timeout = self.heap[0][0] - time.time() if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+scheduler = ShopScheduler()
+
+async def apply_scheduled_event(bot: commands.Bot, event: Dict[str, Any]):
+    """Make the change, persist it, and queue one sync of that shop."""
+    store = SHOP_STORES.get(event["shop"])
+    if store is None:
+        raise ValueError(f"there is no shop `{event['shop']}`")
+    kind = event["kind"]
+
+    if kind in ("restock", "price"):
+        item_id = event["item_id"]
+        async with item_locks.hold(item_id):
+            item = store.items.get(item_id)
+            if item is None:
+                raise ValueError(f"`{item_id}` isn't in the {store.label} anymore")
+            if kind == "restock":
+                amount = parse_stock(event["value"])
+                if item.get("role_stock"):
+                    for role_id in item["role_stock"]:
+                        item["role_stock"][role_id] = amount
+                else:
+                    item["stock"] = amount
+            else:
+                item["price"] = int(event["value"])
+            store.item_changed(item_id, f"schedule:{kind}")
+        await storage.commit()
+    else:
+        # every item lock, so no purchase is halfway through while it flips
+        async with item_locks.hold(*store.items):
+            store.data["open"] = kind == "open"
+            store.settings_changed()
+        # shop-level keys have no journal entry, only snapshots; write it
+        # now, the event is dropped from schedule.json right after this
+        await flush_all_async()
+
+    print(f"Scheduled event #{event['id']}: {describe_event(event)}.")
+    shop_sync.mark_dirty(event["shop"])
+
+
+# ---------------------------
+# BOT SETUP
+# ---------------------------
+
+class GCBot(commands.Bot):
+    def __init__(self):
+        super().__init__(
+            command_prefix="!",
+            intents=intents,
+            help_command=None,
+            http_trace=make_http_trace(),
+            # don't download (and keep) every member of every guild: the
+            # server is big, the cast is small. Commands that need a role's
+            # members fetch them (fetch_role_members)
+            chunk_guilds_at_startup=False,
+            member_cache_flags=discord.MemberCacheFlags.none()
+        )
+
+    async def setup_hook(self):
+        # runs once per process (on_ready runs again on every reconnect):
+        # load shops/players into memory, on the disk thread so a big
+        # players.json doesn't stall the loop
+        await disk.run(init_shop_files)
+        await disk.run(scheduler.load)
+
+        # pick up hand edits of the shop files while running. Not with a
+        # backend that doesn't keep them current: swapping in a stale file
+        # would reset every other item's stock and price
+        self.shop_watcher = None
+        if storage.shop_files_are_live:
+            self.shop_watcher = asyncio.create_task(watch_shop_files(self))
+        else:
+            print("Shop files aren't watched with this storage backend; edits to them are ignored.")
+
+        # timed restocks / price changes / openings
+        self.scheduler_task = asyncio.create_task(scheduler.run(self))
+
+        if METRICS_ENABLED and METRICS_FILE:
+            self.metrics_writer = asyncio.create_task(write_metrics_periodically())
+
+        await self.sync_commands_if_changed()
+
+    def command_tree_hash(self, guild: discord.abc.Snowflake | None) -> str:
+        payload = [cmd.to_dict(self.tree) for cmd in self.tree.get_commands(guild=guild)]
+        payload.sort(key=lambda c: c["name"])
+        return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    async def sync_commands_if_changed(self):
+        """
+        Push the slash commands to Discord, but only if they changed since
+        the last push from this application (to this scope). Syncing is
+        slow and rate limited, and most restarts don't touch the commands.
+        """
+        guild = None
+        scope = "global"
+        if DEV_GUILD_ID:
+            guild = discord.Object(id=DEV_GUILD_ID)
+            scope = f"guild:{DEV_GUILD_ID}"
+            self.tree.copy_global_to(guild=guild)
+
+        tree_hash = self.command_tree_hash(guild)
+        synced = await load_json_async(COMMAND_SYNC_FILE, {})
+        key = f"{self.application_id}/{scope}"
+        if synced.get(key) == tree_hash:
+            print("Slash commands unchanged, not syncing.")
+            return
+
+        await self.tree.sync(guild=guild)
+        synced[key] = tree_hash
+        await save_json_async(COMMAND_SYNC_FILE, synced)
+        print(f"Slash commands synced ({scope}).")
+
+    async def close(self):
+        # don't lose whatever the write-behind flush hasn't written yet
+        await flush_all_async()
+        await announcements.drain()
+        if METRICS_ENABLED:
+            await write_metrics_async()
+        await super().close()
+
+
+bot = GCBot()
+shop_sync = ShopSyncScheduler(bot)
+
+
+# ---------------------------
+# SLASH COMMAND: /confsetup
+# ---------------------------
+
+@bot.tree.command(
+    name="confsetup",
+    description="Create conf/submission channels for each member of a role."
+)
+@app_commands.describe(
+    role="Players role.",
+    conf_category="Category for confessionals.",
+    submissions_category="Category for submissions (optional).",
+    prod_role="Staff role with access (optional)."
+)
+@timed_command("/confsetup")
+async def confsetup(
+    interaction: discord.Interaction,
+    role: discord.Role,
+    conf_category: discord.CategoryChannel,
+    submissions_category: discord.CategoryChannel | None = None,
+    prod_role: discord.Role | None = None
+):
+    guild = interaction.guild
+    if guild is None:
+        await interaction.response.send_message(
+            "Use this in a server.",
+            ephemeral=True
+        )
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    players_role_members = await fetch_role_members(guild, role)
+
+    created_conf_channels = []
+    created_sub_channels = []
+    skipped_conf_existing = []
+    skipped_sub_existing = []
+    failed_channels = []
+
+    # category ID -> {member ID -> channel ID}, so reruns only do what's missing
+    provision_plan = await load_provision_plan()
+    conf_plan = provision_plan.setdefault(str(conf_category.id), {})
+    sub_plan = {}
+
+    conf_existing, conf_missing = plan_category_channels(
+        conf_category, players_role_members, conf_plan
+    )
+    skipped_conf_existing.extend(conf_existing)
+
+    sub_existing, sub_missing = [], []
+    if submissions_category is not None:
+        sub_plan = provision_plan.setdefault(str(submissions_category.id), {})
+        sub_existing, sub_missing = plan_category_channels(
+            submissions_category, players_role_members, sub_plan, suffix="-submissions"
+        )
+        skipped_sub_existing.extend(sub_existing)
+
+    # adopted channels count as progress too
+    await save_provision_plan(provision_plan)
+
+    # (kind, member, create_private_channel kwargs)
+    jobs = []
+
+    for member, conf_name in conf_missing:
+        jobs.append(("conf", member, {
+            "name": conf_name,
+            "category": conf_category,
+            "topic": f"Confessional for {member.display_name}",
+            "intro_message": (
+                f"Willkommen to your confessional, {member.mention}. "
+                "Report your thoughts here. Alles wird überwacht. 🕵️"
+            )
+        }))
+
+    for member, sub_name in sub_missing:
+        jobs.append(("sub", member, {
+            "name": sub_name,
+            "category": submissions_category,
+            "topic": f"Challenge submissions for {member.display_name}",
+            "intro_message": (
+                f"{member.mention} — post your official answers here. "
+                "Edits after deadline will not count."
+            )
+        }))
+
+    progress_msg = None
+    if jobs:
+        progress_msg = await interaction.followup.send(
+            f"Creating {len(jobs)} channel(s)…",
+            ephemeral=True,
+            wait=True
+        )
+
+    # No fixed sleeps: discord.py already waits on the rate-limit headers
+    # of every response, we just cap how many creations are in flight.
+    semaphore = asyncio.Semaphore(PROVISION_CONCURRENCY)
+    done = 0
+    last_progress = time.monotonic()
+
+    async def run_job(kind: str, member: discord.Member, kwargs: Dict[str, Any]):
+        nonlocal done, last_progress
+        async with semaphore:
+            try:
+                ch = await create_private_channel(
+                    guild,
+                    player=member,
+                    prod_role=prod_role,
+                    **kwargs
+                )
+            except discord.HTTPException as e:
+                failed_channels.append((member, kwargs["name"], e))
+            else:
+                if kind == "conf":
+                    created_conf_channels.append((member, ch))
+                    conf_plan[str(member.id)] = ch.id
+                else:
+                    created_sub_channels.append((member, ch))
+                    sub_plan[str(member.id)] = ch.id
+                # record it right away, so a crash/timeout doesn't lose it
+                await save_provision_plan(provision_plan)
+
+        done += 1
+        if done < len(jobs) and time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+            last_progress = time.monotonic()
+            try:
+                await progress_msg.edit(content=f"Creating channels… {done}/{len(jobs)}")
+            except discord.HTTPException:
+                pass  # progress is best effort
+
+    await asyncio.gather(*(run_job(*job) for job in jobs))
+
+    summary_lines = []
+    summary_lines.append(f"Done in **{guild.name}**.")
+    summary_lines.append(f"Players with {role.mention}: {len(players_role_members)}")
+
+    if created_conf_channels:
+        summary_lines.append(
+            f"Created {len(created_conf_channels)} confessional channel(s) in {conf_category.name}."
+        )
+    if skipped_conf_existing:
+        summary_lines.append(
+            f"Skipped {len(skipped_conf_existing)} confessional channel(s) (already existed)."
+        )
+
+    if submissions_category is not None:
+        if created_sub_channels:
+            summary_lines.append(
+                f"Created {len(created_sub_channels)} submissions channel(s) in {submissions_category.name}."
+            )
+        if skipped_sub_existing:
+            summary_lines.append(
+                f"Skipped {len(skipped_sub_existing)} submissions channel(s) (already existed)."
+            )
+
+    clashes = sum(
+        1 for m, name in conf_missing
+        if name != sanitize_channel_name(m.display_name)
+    ) + sum(
+        1 for m, name in sub_missing
+        if name != f"{sanitize_channel_name(m.display_name)}-submissions"
+    )
+    if clashes:
+        summary_lines.append(
+            f"Numbered {clashes} channel name(s) because display names clashed."
+        )
+
+    if failed_channels:
+        failed_names = ", ".join(f"`{name}`" for _, name, _ in failed_channels[:20])
+        summary_lines.append(
+            f"Failed to create {len(failed_channels)} channel(s): {failed_names}. Run it again to retry."
+        )
+
+    if progress_msg is not None:
+        await progress_msg.edit(content="\n".join(summary_lines))
+    else:
+        await interaction.followup.send(
+            "\n".join(summary_lines),
+            ephemeral=True
+        )
+@bot.tree.command(
+    name="wallet",
+    description="Check a wallet. Hosts can view anyone; players can view themselves."
+)
+@app_commands.describe(
+    player="Whose wallet to view. Leave empty to view your own."
+)
+@timed_command("/wallet")
+async def wallet_cmd(
+    interaction: discord.Interaction,
+    player: discord.Member | None = None
+):
+    guild = interaction.guild
+    if guild is None:
+        await interaction.response.send_message(
+            "Use this in a server.",
+            ephemeral=True
+        )
+        return
+
+    requester: discord.Member = interaction.user
+
+    # Who are we allowed to inspect?
+    if is_host(requester):
+        target = player or requester
+    else:
+        if player is None or player.id == requester.id:
+            target = requester
+        else:
+            await interaction.response.send_message(
+                "You can only view your own wallet.",
+                ephemeral=True
+            )
+            return
+
+    msg = format_wallet_message(target)
+
+    await interaction.response.send_message(
+        msg,
+        ephemeral=True
+    )
+@bot.tree.command(
+    name="walletcreate",
+    description="Add players to the economy file with empty wallets (hosts only)."
+)
+@app_commands.describe(
+    user="Create/update wallet for this user.",
+    role="Or create/update wallets for everyone with this role."
+)
+@timed_command("/walletcreate")
+async def walletcreate_cmd(
+    interaction: discord.Interaction,
+    user: discord.Member | None = None,
+    role: discord.Role | None = None
+):
+    guild = interaction.guild
+    if guild is None:
+        await interaction.response.send_message(
+            "Use this in a server.",
+            ephemeral=True
+        )
+        return
+
+    requester: discord.Member = interaction.user
+
+    # Only hosts:
+    if not is_host(requester):
+        await interaction.response.send_message(
+            "You do not have permission to do that.",
+            ephemeral=True
+        )
+        return
+
+    # fetching a role's members can take a while on a big server
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    role_members = await fetch_role_members(guild, role) if role is not None else []
+
+    players = load_players()
+
+    new_count = 0
+    touched_members: list[discord.Member] = []
+
+    # Single user
+    if user is not None:
+        if ensure_player_entry(user, players):
+            new_count += 1
+        touched_members.append(user)
+
+    # Role batch
+    if role is not None:
+        for m in role_members:
+            if ensure_player_entry(m, players):
+                new_count += 1
+            touched_members.append(m)
+
+    for uid in {str(m.id) for m in touched_members}:
+        player_store.wallet_changed(uid, "walletcreate")
+    await storage.commit()
+
+    if not touched_members:
+        summary = "No targets provided. Specify a user or a role."
+    else:
+        uniq_ids = {m.id for m in touched_members}
+        summary = (
+            f"Registered {len(uniq_ids)} player(s). "
+            f"New wallets created: {new_count}."
+        )
+
+    await interaction.followup.send(
+        summary,
+        ephemeral=True
+    )
+
+async def run_batch_command(
+    interaction: discord.Interaction,
+    sign: int,
+    money: int,
+    item: str | None,
+    quantity: int,
+    user: discord.Member | None,
+    role: discord.Role | None,
+    members: str | None,
+    everyone: bool
+):
+    """Shared body of /grant (sign=1) and /deduct (sign=-1)."""
+    guild = interaction.guild
+    if guild is None:
+        await interaction.response.send_message(
+            "Use this in a server.",
+            ephemeral=True
+        )
+        return
+
+    requester: discord.Member = interaction.user
+
+    # Only hosts:
+    if not is_host(requester):
+        await interaction.response.send_message(
+            "You do not have permission to do that.",
+            ephemeral=True
+        )
+        return
+
+    if money < 0:
+        await interaction.response.send_message(
+            "Money can't be negative.",
+            ephemeral=True
+        )
+        return
+
+    if quantity < 1:
+        await interaction.response.send_message(
+            "Quantity must be at least 1.",
+            ephemeral=True
+        )
+        return
+
+    if not money and item is None:
+        await interaction.response.send_message(
+            "Nothing to do. Specify money and/or an item.",
+            ephemeral=True
+        )
+        return
+
+    if item is not None and sign > 0 and find_item_in_shops(item) is None:
+        await interaction.response.send_message(
+            f"There is no item `{item}`.",
+            ephemeral=True
+        )
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    targets = await collect_batch_targets(guild, user, role, members, everyone)
+    if not targets:
+        await interaction.followup.send(
+            "No targets provided. Specify a user, a role, members or everyone.",
+            ephemeral=True
+        )
+        return
+
+    short = await apply_batch(
+        targets,
+        sign * money,
+        item,
+        sign * quantity if item is not None else 0,
+        "grant" if sign > 0 else "deduct"
+    )
+
+    what = []
+    if money:
+        what.append(f"{money} DM")
+    if item is not None:
+        what.append(f"{quantity}× {resolve_item_name(item)} (`{item}`)")
+    verb = "Granted" if sign > 0 else "Deducted"
+    prep = "to" if sign > 0 else "from"
+    summary = f"{verb} {' and '.join(what)} {prep} {len(targets)} wallet(s)."
+    if short:
+        summary += f" {short} didn't have enough and are now at zero."
+
+    await interaction.followup.send(
+        summary,
+        ephemeral=True
+    )
+
+@bot.tree.command(
+    name="grant",
+    description="Give money and/or items to several wallets at once (hosts only)."
+)
+@app_commands.describe(
+    money="Deutsche Marks to give each target.",
+    item="Item ID to give each target.",
+    quantity="How many of the item (default 1).",
+    user="A single player.",
+    role="Everyone with this role.",
+    members="Several players: mentions or IDs separated by spaces.",
+    everyone="Every player that has a wallet."
+)
+@timed_command("/grant")
+async def grant_cmd(
+    interaction: discord.Interaction,
+    money: int = 0,
+    item: str | None = None,
+    quantity: int = 1,
+    user: discord.Member | None = None,
+    role: discord.Role | None = None,
+    members: str | None = None,
+    everyone: bool = False
+):
+    await run_batch_command(interaction, 1, money, item, quantity, user, role, members, everyone)
+
+@bot.tree.command(
+    name="deduct",
+    description="Take money and/or items from several wallets at once (hosts only)."
+)
+@app_commands.describe(
+    money="Deutsche Marks to take from each target.",
+    item="Item ID to take from each target.",
+    quantity="How many of the item (default 1).",
+    user="A single player.",
+    role="Everyone with this role.",
+    members="Several players: mentions or IDs separated by spaces.",
+    everyone="Every player that has a wallet."
+)
+@timed_command("/deduct")
+async def deduct_cmd(
+    interaction: discord.Interaction,
+    money: int = 0,
+    item: str | None = None,
+    quantity: int = 1,
+    user: discord.Member | None = None,
+    role: discord.Role | None = None,
+    members: str | None = None,
+    everyone: bool = False
+):
+    await run_batch_command(interaction, -1, money, item, quantity, user, role, members, everyone)
+
+# ---------------------------
+# SLASH COMMAND: /stats
+# ---------------------------
+
+@bot.tree.command(
+    name="stats",
+    description="Show command latencies and I/O counters (hosts only)."
+)
+async def stats_cmd(interaction: discord.Interaction):
+    if interaction.guild is None:
+        await interaction.response.send_message(
+            "Use this in a server.",
+            ephemeral=True
+        )
+        return
+
+    if not is_host(interaction.user):
+        await interaction.response.send_message(
+            "You do not have permission to do that.",
+            ephemeral=True
+        )
+        return
+
+    if not METRICS_ENABLED:
+        await interaction.response.send_message(
+            "Metrics are turned off (METRICS_ENABLED).",
+            ephemeral=True
+        )
+        return
+
+    await interaction.response.send_message(
+        metrics.format_summary(),
+        ephemeral=True
+    )
+
+# ---------------------------
+# SLASH COMMANDS: /schedule add | list | cancel
+# ---------------------------
+
+schedule_group = app_commands.Group(
+    name="schedule",
+    description="Timed restocks, price changes and shop openings (hosts only)."
+)
+
+async def check_host(interaction: discord.Interaction) -> bool:
+    """Answer and return False unless a host is using this in a server."""
+    if interaction.guild is None:
+        await interaction.response.send_message(
+            "Use this in a server.",
+            ephemeral=True
+        )
+        return False
+
+    if not is_host(interaction.user):
+        await interaction.response.send_message(
+            "You do not have permission to do that.",
+            ephemeral=True
+        )
+        return False
+    return True
+
+@schedule_group.command(
+    name="add",
+    description="Schedule a restock, price change, opening or closing."
+)
+@app_commands.describe(
+    when="\"+30m\", \"2h\", \"1d12h\" from now, or a UTC time like \"2025-11-01 20:00\".",
+    action="What should happen.",
+    shop="Which shop.",
+    item="Item ID (restock and price only).",
+    value="New stock (\"-\" for unlimited) or new price."
+)
+@app_commands.choices(
+    action=[app_commands.Choice(name=kind, value=kind) for kind in SCHEDULE_KINDS],
+    shop=[
+        app_commands.Choice(name=kaufhaus_store.label, value=KAUFHAUS_FILE),
+        app_commands.Choice(name=schwartz_store.label, value=SCHWARTZ_FILE)
+    ]
+)
+@timed_command("/schedule add")
+async def schedule_add_cmd(
+    interaction: discord.Interaction,
+    when: str,
+    action: str,
+    shop: str,
+    item: str | None = None,
+    value: str | None = None
+):
+    if not await check_host(interaction):
+        return
+
+    try:
+        at = parse_when(when)
+    except ValueError:
+        await interaction.response.send_message(
+            f"I don't understand the time `{when}`. Try `+30m`, `2h` or `2025-11-01 20:00`.",
+            ephemeral=True
+        )
+        return
+
+    if at <= time.time():
+        await interaction.response.send_message(
+            "That time is in the past.",
+            ephemeral=True
+        )
+        return
+
+    if action in ("restock", "price"):
+        if item is None or value is None:
+            await interaction.response.send_message(
+                f"A {action} needs an item and a value.",
+                ephemeral=True
+            )
+            return
+        if item not in SHOP_STORES[shop].items:
+            await interaction.response.send_message(
+                f"There is no item `{item}` in the {SHOP_STORES[shop].label}.",
+                ephemeral=True
+            )
+            return
+        value = value.strip()
+        if action == "restock" and not (value == "-" or value.isdigit()):
+            await interaction.response.send_message(
+                "Stock must be \"-\" (unlimited) or a whole number >= 0.",
+                ephemeral=True
+            )
+            return
+        if action == "price" and not value.isdigit():
+            await interaction.response.send_message(
+                "Price must be a whole number >= 0.",
+                ephemeral=True
+            )
+            return
+    else:
+        item = value = None
+
+    event = await scheduler.add(at, shop, action, item, value, interaction.user.id)
+    await interaction.response.send_message(
+        f"Scheduled #{event['id']}: {describe_event(event)} at <t:{int(at)}:f> (<t:{int(at)}:R>).",
+        ephemeral=True
+    )
+
+@schedule_group.command(
+    name="list",
+    description="Show upcoming scheduled shop events."
+)
+@timed_command("/schedule list")
+async def schedule_list_cmd(interaction: discord.Interaction):
+    if not await check_host(interaction):
+        return
+
+    events = scheduler.upcoming()
+    if not events:
+        text = "Nothing is scheduled."
+    else:
+        lines = [
+            f"#{event['id']} <t:{int(event['at'])}:f>: {describe_event(event)}"
+            for event in events
+        ]
+        text = "\n".join(lines)
+        if len(text) > SHOP_MESSAGE_LIMIT:
+            text = text[:SHOP_MESSAGE_LIMIT - 20].rsplit("\n", 1)[0] + "\n..."
+    await interaction.response.send_message(text, ephemeral=True)
+
+@schedule_group.command(
+    name="cancel",
+    description="Cancel a scheduled shop event."
+)
+@app_commands.describe(event_id="The number shown by /schedule list.")
+@timed_command("/schedule cancel")
+async def schedule_cancel_cmd(interaction: discord.Interaction, event_id: int):
+    if not await check_host(interaction):
+        return
+
+    event = await scheduler.cancel(event_id)
+    if event is None:
+        await interaction.response.send_message(
+            f"There is no scheduled event #{event_id}.",
+            ephemeral=True
+        )
+        return
+    await interaction.response.send_message(
+        f"Cancelled #{event_id}: {describe_event(event)}.",
+        ephemeral=True
+    )
+
+bot.tree.add_command(schedule_group)
+
+# ---------------------------
+# TEXT COMMAND: !buy
+# ---------------------------
+
+@bot.command(name="buy")
+@timed_command("!buy")
+async def buy_command(ctx: commands.Context, *args: str):
+    """
+    !buy <itemID> [quantity]
+    !buy <itemID> <itemID> ...   (a quantity can follow each ID)
+    - checks price, stock, money for everything at once
+    - deducts money
+    - grants items
+    - announces the purchase (once)
+    - refreshes shop messages (once per shop)
+    """
+    buyer = ctx.author
+
+    if not args:
+        await ctx.send(
+            f"{buyer.mention} Usage: `!buy <itemID> [quantity]` or `!buy <itemID> <itemID> ...`"
+        )
+        return
+
+    try:
+        lines = await purchase_items(buyer, parse_cart(args))
+    except PurchaseError as e:
+        await ctx.send(f"{buyer.mention} {e}")
+        return
+
+    # Announce
+    announcements.announce(ctx.channel, format_purchase_announcement(buyer, lines))
+
+    # refresh the shops this came from so the stock display updates
+    for which_file in {line[0] for line in lines}:
+        shop_sync.mark_dirty(which_file)
+
+
+# ---------------------------
+# SLASH COMMAND: /buy
+# ---------------------------
+
+AUTOCOMPLETE_LIMIT = 25  # most choices Discord shows
+
+async def buy_item_autocomplete(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+    """
+    Items matching what the caller typed so far that they could buy right
+    now: shop open, enough money and stock left for their roles. Memory only, this
+    has to answer within Discord's autocomplete deadline.
+    """
+    buyer = interaction.user
+    buyer_roles = tuple([r.id for r in getattr(buyer, "roles", []) if not r.is_default()])
+    pdata = player_store.data.get(str(buyer.id))
+    money = pdata.get("money", 0) if pdata else 0
+
+    choices = []
+    for item_id, which_file, item in catalog.search(current.strip()):
+        price = int(item.get("price", 0))
+        if price > money or not SHOP_STORES[which_file].is_open or not has_stock_for(item, buyer_roles):
+            continue
+        label = f"{item.get('name', item_id)} ({item_id}) - {price} DM"
+        choices.append(app_commands.Choice(name=label[:100], value=item_id))
+        if len(choices) >= AUTOCOMPLETE_LIMIT:
+            break
+    return choices
+
+@bot.tree.command(
+    name="buy",
+    description="Buy an item from the shops."
+)
+@app_commands.describe(
+    item="What to buy. Start typing its name or ID.",
+    quantity="How many (default 1)."
+)
+@app_commands.autocomplete(item=buy_item_autocomplete)
+@timed_command("/buy")
+async def buy_slash(
+    interaction: discord.Interaction,
+    item: str,
+    quantity: app_commands.Range[int, 1, 100] = 1
+):
+    if interaction.guild is None:
+        await interaction.response.send_message(
+            "Use this in a server.",
+            ephemeral=True
+        )
+        return
+
+    buyer = interaction.user
+
+    # in a rush the purchase can wait on the item lock for longer than
+    # Discord gives us to answer the interaction
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    try:
+        lines = await purchase_items(buyer, {item: quantity})
+    except PurchaseError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
+        return
+
+    announcements.announce(interaction.channel, format_purchase_announcement(buyer, lines))
+    shop_sync.mark_dirty(lines[0][0])
+
+    await interaction.followup.send("Done! Your purchase is in your `/wallet`.", ephemeral=True)
+
+
+# ---------------------------
+# EVENTS
+# ---------------------------
+
+@bot.event
+async def on_ready():
+    # runs again after every gateway reconnect, so nothing here may
+    # touch the disk unless something actually changed
+    await bot.change_presence(
+        activity=discord.CustomActivity(name="Coming up with challenges")
+    )
+
+    # both shops at once. The first time there are no hashes yet so every
+    # message gets checked; after a reconnect this is a no-op unless a shop
+    # changed while we were gone
+    results = await asyncio.gather(
+        *(sync_shop_channel(bot, path) for path in SHOP_STORES),
+        return_exceptions=True
+    )
+    for path, result in zip(SHOP_STORES, results):
+        if isinstance(result, Exception):
+            print(f"Shop sync for {path} failed: {result}")
+
+    print(f"GCbot is online as {bot.user} (id={bot.user.id})")
+
+# ---------------------------
+# RUN
+# ---------------------------
+
+if __name__ == "__main__":
+    if BOT_TOKEN == "PUT_YOUR_TOKEN_HERE":
+        raise RuntimeError("You forgot to set BOT_TOKEN in the script.")
+    bot.run(BOT_TOKEN)
@@ -0,0 +1,607 @@
+"""
+End-to-end load test for gcbot.py against a fake Discord.
+
+Starts a local stand-in for Discord's REST API (aiohttp), points discord.py at
+it, builds a guild in the bot's cache the way the gateway would, and then feeds
+the bot messages and interactions directly - no token, no live guild.
+
+Scenarios:
+  - buy rush:   N buyers send `!buy` for an item with limited stock at once
+  - wallets:    M concurrent /wallet checks
+  - confsetup:  /confsetup for a big cast, then again (should be a no-op)
+
+The guild can be padded with members who have nothing to do with the game
+(--lurkers); the bot doesn't chunk guilds, so they only cost member-list
+pages when a command needs a role's members.
+
+For every scenario it counts the REST calls per route, and it can answer a
+share of them with 429s to exercise discord.py's retry path (--rate-limit).
+The buy rush checks the economy afterwards: no oversell, every debit matched
+by an item, and no negative wallets.
+
+    python loadtest.py
+    python loadtest.py --buyers 200 --stock 25 --cast 60 --lurkers 5000 --rate-limit 0.1 --out test_output.txt
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+import discord
+from aiohttp import web
+
+import gcbot
+
+
+# ---------------------------
+# FAKE DISCORD REST API
+# ---------------------------
+
+TIMESTAMP = datetime.now(timezone.utc).isoformat()
+
+_snowflakes = itertools.count(1100000000000000000)
+
+def snowflake() -> str:
+    return str(next(_snowflakes))
+
+def user_payload(uid: str, name: str, bot: bool = False) -> Dict[str, Any]:
+    return {
+        "id": uid,
+        "username": name,
+        "global_name": name,
+        "discriminator": "0",
+        "avatar": None,
+        "bot": bot
+    }
+
+
+def json_reply(data: Any, status: int = 200, headers: Dict[str, str] | None = None) -> web.Response:
+    # discord.py only parses bodies whose content type is exactly application/json,
+    # web.json_response would tack a charset on
+    return web.Response(
+        body=json.dumps(data).encode("utf-8"),
+        status=status,
+        headers={"Content-Type": "application/json", **(headers or {})}
+    )
+
+
+class UnknownMessage(Exception):
+    pass
+
+
+class FakeDiscord:
+    """
+    Just the REST endpoints gcbot uses. Every request is counted under its
+    route template (IDs replaced by {id}); a share of them can be answered
+    with a 429 first.
+    """
+
+    def __init__(self, rate_limit: float, rng: random.Random):
+        self.rate_limit = rate_limit
+        self.rng = rng
+        self.calls: Counter = Counter()
+        self.rate_limited = 0
+        self.bot_user = user_payload(snowflake(), "GCBot", bot=True)
+        self.application_id = snowflake()
+        self.guild_id = ""
+        self.messages: Dict[str, Dict[str, Any]] = {}  # message id -> payload
+        self.state = None  # discord.py ConnectionState, for "gateway" events
+        self.members: Dict[str, Dict[str, Any]] = {}  # member ID -> member payload
+
+    def reset_counts(self):
+        self.calls = Counter()
+        self.rate_limited = 0
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/api/v10/{tail:.*}", self.handle)
+        return app
+
+    # --- dispatch ---
+
+    ROUTES = [
+        ("GET", r"/users/@me$", "get_me"),
+        ("GET", r"/oauth2/applications/@me$", "get_application"),
+        ("PUT", r"/applications/(\d+)/commands$", "put_commands"),
+        ("PUT", r"/applications/(\d+)/guilds/(\d+)/commands$", "put_commands"),
+        ("POST", r"/channels/(\d+)/messages$", "create_message"),
+        ("GET", r"/channels/(\d+)/messages$", "list_messages"),
+        ("PATCH", r"/channels/(\d+)/messages/(\d+)$", "edit_message"),
+        ("DELETE", r"/channels/(\d+)/messages/(\d+)$", "delete_message"),
+        ("POST", r"/guilds/(\d+)/channels$", "create_channel"),
+        ("GET", r"/guilds/(\d+)/members$", "list_members"),
+        ("POST", r"/interactions/(\d+)/([^/]+)/callback$", "interaction_callback"),
+        ("POST", r"/webhooks/(\d+)/([^/]+)$", "create_followup"),
+        ("PATCH", r"/webhooks/(\d+)/([^/]+)/messages/(\d+|@original)$", "edit_followup"),
+    ]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        path = "/" + request.match_info["tail"]
+        template = re.sub(r"/\d+", "/{id}", path)
+        template = re.sub(r"/(interactions|webhooks)/\{id\}/[^/]+", r"/\1/{id}/{token}", template)
+        self.calls[f"{request.method} {template}"] += 1
+
+        if self.rate_limit and self.rng.random() < self.rate_limit:
+            self.rate_limited += 1
+            retry_after = 0.05
+            return json_reply(
+                {"message": "You are being rate limited.", "retry_after": retry_after, "global": False},
+                status=429,
+                headers={
+                    "Retry-After": str(retry_after),
+                    "X-RateLimit-Scope": "user",
+                    "Via": "1.1 google"
+                }
+            )
+
+        for method, pattern, handler_name in self.ROUTES:
+            if request.method != method:
+                continue
+            m = re.match(pattern, path)
+            if m is None:
+                continue
+            body = await request.json() if request.can_read_body else dict(request.query)
+            try:
+                result = getattr(self, handler_name)(body, *m.groups())
+            except UnknownMessage:
+                return json_reply({"message": "Unknown Message", "code": 10008}, status=404)
+            if result is None:
+                return web.Response(status=204)
+            return json_reply(result)
+
+        return json_reply({"message": "Unknown route", "code": 0}, status=404)
+
+    # --- handlers ---
+
+    def get_me(self, body):
+        return self.bot_user
+
+    def get_application(self, body):
+        return {
+            "id": self.application_id,
+            "name": "GCBot",
+            "icon": None,
+            "description": "",
+            "rpc_origins": [],
+            "bot_public": False,
+            "bot_require_code_grant": False,
+            "owner": user_payload(snowflake(), "owner"),
+            "summary": "",
+            "verify_key": "0",
+            "flags": 0
+        }
+
+    def put_commands(self, body, *ids):
+        return []
+
+    def message_payload(self, channel_id: str, content: str) -> Dict[str, Any]:
+        return {
+            "id": snowflake(),
+            "channel_id": channel_id,
+            "author": self.bot_user,
+            "content": content,
+            "timestamp": TIMESTAMP,
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+            "flags": 0
+        }
+
+    def create_message(self, body, channel_id):
+        msg = self.message_payload(channel_id, body.get("content") or "")
+        self.messages[msg["id"]] = msg
+        return msg
+
+    def list_messages(self, body, channel_id):
+        in_channel = [m for m in self.messages.values() if m["channel_id"] == channel_id]
+        return list(reversed(in_channel))[:1]
+
+    def edit_message(self, body, channel_id, message_id):
+        msg = self.messages.get(message_id)
+        if msg is None:
+            raise UnknownMessage(message_id)
+        msg["content"] = body.get("content", msg["content"])
+        return msg
+
+    def delete_message(self, body, channel_id, message_id):
+        self.messages.pop(message_id, None)
+        return None
+
+    def create_channel(self, body, guild_id):
+        channel = {
+            "id": snowflake(),
+            "type": body.get("type", 0),
+            "name": body["name"],
+            "guild_id": guild_id,
+            "parent_id": body.get("parent_id"),
+            "position": 0,
+            "topic": body.get("topic"),
+            "permission_overwrites": body.get("permission_overwrites", [])
+        }
+        # what the gateway would tell the bot right after
+        self.state.parse_channel_create(channel)
+        return channel
+
+    def list_members(self, body, guild_id):
+        limit = int(body.get("limit", 1))
+        after = int(body.get("after", 0))
+        ids = sorted(int(uid) for uid in self.members if int(uid) > after)
+        return [self.members[str(uid)] for uid in ids[:limit]]
+
+    def interaction_callback(self, body, interaction_id, token):
+        return {"interaction": {"id": interaction_id, "type": 2}}
+
+    def create_followup(self, body, application_id, token):
+        msg = self.message_payload(self.guild_id, body.get("content") or "")
+        msg["webhook_id"] = application_id
+        self.messages[msg["id"]] = msg
+        return msg
+
+    def edit_followup(self, body, application_id, token, message_id):
+        msg = self.messages.get(message_id) or self.message_payload(self.guild_id, "")
+        msg["content"] = body.get("content", msg["content"])
+        return msg
+
+
+# ---------------------------
+# FAKE GATEWAY STATE
+# ---------------------------
+
+class FakeGuild:
+    """
+    Builds the guild in the bot's cache (what GUILD_CREATE would do)
+    and hands out message/interaction payloads for it.
+    """
+
+    def __init__(self, fake: FakeDiscord, state, cast: int, buyers: int, lurkers: int = 0):
+        self.fake = fake
+        self.state = state
+        self.id = snowflake()
+        fake.guild_id = self.id
+
+        self.host_id = snowflake()
+        self.players_role = snowflake()
+        self.category_conf = snowflake()
+        self.category_subs = snowflake()
+        self.shop_channel = snowflake()
+        self.chat_channel = snowflake()
+
+        roles = [
+            self.role_payload(self.id, "@everyone"),
+            self.role_payload(self.players_role, "Players"),
+        ]
+        channels = [
+            {"id": self.category_conf, "type": 4, "name": "confessionals", "position": 0, "permission_overwrites": []},
+            {"id": self.category_subs, "type": 4, "name": "submissions", "position": 1, "permission_overwrites": []},
+            {"id": self.shop_channel, "type": 0, "name": "kaufhaus", "position": 2, "permission_overwrites": []},
+            {"id": self.chat_channel, "type": 0, "name": "chat", "position": 3, "permission_overwrites": []},
+        ]
+
+        self.members = fake.members
+        self.add_member(fake.bot_user["id"], "GCBot", [], bot=True)
+        self.add_member(self.host_id, "Host", [])
+        self.cast_ids = [self.add_member(snowflake(), f"Player {i % (cast // 2 or 1)}", [self.players_role])
+                         for i in range(cast)]  # half the names collide on purpose
+        self.buyer_ids = [self.add_member(snowflake(), f"Buyer {i}", []) for i in range(buyers)]
+        for i in range(lurkers):
+            self.add_member(snowflake(), f"Lurker {i}", [])
+
+        guild_payload = {
+            "id": self.id,
+            "name": "Load Test",
+            "owner_id": self.host_id,
+            "roles": roles,
+            "channels": channels,
+            # GUILD_CREATE of a large guild only has a few members; the bot
+            # doesn't ask for the rest
+            "members": [self.members[fake.bot_user["id"]]],
+            "member_count": len(self.members),
+            "features": [],
+            "emojis": [],
+            "stickers": [],
+            "verification_level": 0,
+            "default_message_notifications": 0,
+            "explicit_content_filter": 0,
+            "mfa_level": 0,
+            "premium_tier": 0,
+            "preferred_locale": "en-US",
+            "nsfw_level": 0
+        }
+        guild = discord.Guild(data=guild_payload, state=state)
+        state._add_guild(guild)
+        self.guild = guild
+
+    @staticmethod
+    def role_payload(role_id: str, name: str) -> Dict[str, Any]:
+        return {
+            "id": role_id,
+            "name": name,
+            "color": 0,
+            "hoist": False,
+            "position": 0,
+            "permissions": "0",
+            "managed": False,
+            "mentionable": False
+        }
+
+    def add_member(self, uid: str, name: str, roles: list[str], bot: bool = False) -> str:
+        self.members[uid] = {
+            "user": user_payload(uid, name, bot=bot),
+            "roles": roles,
+            "joined_at": TIMESTAMP,
+            "deaf": False,
+            "mute": False,
+            "nick": None,
+            "flags": 0
+        }
+        return uid
+
+    def message(self, author_id: str, content: str) -> discord.Message:
+        member = self.members[author_id]
+        data = {
+            "id": snowflake(),
+            "channel_id": self.chat_channel,
+            "guild_id": self.id,
+            "author": member["user"],
+            "member": {k: v for k, v in member.items() if k != "user"},
+            "content": content,
+            "timestamp": TIMESTAMP,
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0
+        }
+        channel = self.guild.get_channel(int(self.chat_channel))
+        return discord.Message(state=self.state, channel=channel, data=data)
+
+    def interaction(self, user_id: str, name: str, options: list, resolved: Dict[str, Any] | None = None) -> discord.Interaction:
+        data = {
+            "id": snowflake(),
+            "application_id": self.fake.application_id,
+            "type": 2,
+            "token": f"tok{snowflake()}",
+            "version": 1,
+            "guild_id": self.id,
+            "channel": {"id": self.chat_channel, "type": 0},
+            "channel_id": self.chat_channel,
+            "member": dict(self.members[user_id], permissions="8"),
+            "attachment_size_limit": 8 * 1024 * 1024,
+            "data": {
+                "id": snowflake(),
+                "name": name,
+                "type": 1,
+                "options": options,
+                "resolved": resolved or {}
+            }
+        }
+        return discord.Interaction(data=data, state=self.state)
+
+
+# ---------------------------
+# SCENARIOS
+# ---------------------------
+
+def route_report(fake: FakeDiscord) -> list[str]:
+    return [f"    {count:>5}  {route}" for route, count in fake.calls.most_common()]
+
+async def wait_for_background_sends():
+    """Shop syncs and announcement digests go out after the command returned."""
+    await asyncio.sleep(max(gcbot.SHOP_SYNC_WINDOW, gcbot.ANNOUNCE_WINDOW) + 0.2)
+    tasks = [t for t in gcbot.shop_sync.tasks.values() if not t.done()]
+    tasks += list(gcbot.announcements.digests.values()) + list(gcbot.announcements.sends)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+async def scenario_buy_rush(fake: FakeDiscord, fg: FakeGuild, args: argparse.Namespace) -> list[str]:
+    item_id = "loadtest-idol"
+    price = 7
+    gcbot.kaufhaus_store.items[item_id] = gcbot.parse_item({
+        "name": "Load Test Idol",
+        "description": "Only a few of these.",
+        "price": price,
+        "stock": str(args.stock),
+        "public_stock": "y",
+        "role_stock": None
+    })
+    gcbot.kaufhaus_store.items_changed()
+
+    players = gcbot.load_players()
+    for uid in fg.buyer_ids:
+        players[uid] = {"name": fg.members[uid]["user"]["username"], "money": 100, "items": {}}
+    money_before = sum(players[uid]["money"] for uid in fg.buyer_ids)
+
+    fake.reset_counts()
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        gcbot.bot.process_commands(fg.message(uid, f"!buy {item_id}"))
+        for uid in fg.buyer_ids
+    ))
+    elapsed = time.perf_counter() - start
+    await wait_for_background_sends()
+
+    bought = sum(players[uid]["items"].get(item_id, 0) for uid in fg.buyer_ids)
+    debited = money_before - sum(players[uid]["money"] for uid in fg.buyer_ids)
+    stock_left = gcbot.kaufhaus_store.items[item_id]["stock"]
+    # digests hold several announcements in one message
+    announcement_msgs = [m["content"] for m in fake.messages.values() if "Congratulations" in m["content"]]
+    announcements = sum(text.count("Congratulations") for text in announcement_msgs)
+    host_pings = sum(text.count(gcbot.HOST_PING) for text in announcement_msgs)
+
+    problems = []
+    expected = min(args.stock, len(fg.buyer_ids))
+    if bought != expected:
+        problems.append(f"expected {expected} sold, inventories hold {bought}")
+    if debited != bought * price:
+        problems.append(f"debited {debited} DM for {bought} item(s) at {price} DM")
+    if stock_left != args.stock - bought:
+        problems.append(f"stock is {stock_left}, expected {args.stock - bought}")
+    if any(players[uid]["money"] < 0 for uid in fg.buyer_ids):
+        problems.append("a wallet went negative")
+    if announcements != bought:
+        problems.append(f"{announcements} announcement(s) for {bought} purchase(s)")
+
+    total = sum(fake.calls.values())
+    lines = [
+        f"buy rush: {len(fg.buyer_ids)} buyers, stock {args.stock}, {elapsed:.2f}s",
+        f"  sold {bought}, debited {debited} DM, stock left {stock_left}",
+        f"  announced in {len(announcement_msgs)} message(s), {host_pings} host ping(s)",
+        f"  REST calls: {total} ({total / len(fg.buyer_ids):.2f} per !buy), 429s injected: {fake.rate_limited}",
+    ]
+    lines += route_report(fake)
+    lines.append("  OK" if not problems else "  FAILED: " + "; ".join(problems))
+    return lines
+
+async def scenario_wallets(fake: FakeDiscord, fg: FakeGuild, args: argparse.Namespace) -> list[str]:
+    fake.reset_counts()
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        gcbot.bot.tree._call(fg.interaction(fg.buyer_ids[i % len(fg.buyer_ids)], "wallet", []))
+        for i in range(args.wallets)
+    ))
+    elapsed = time.perf_counter() - start
+
+    total = sum(fake.calls.values())
+    lines = [
+        f"wallets: {args.wallets} concurrent /wallet, {elapsed:.2f}s",
+        f"  REST calls: {total} ({total / args.wallets:.2f} per /wallet), 429s injected: {fake.rate_limited}",
+    ]
+    lines += route_report(fake)
+    return lines
+
+async def scenario_confsetup(fake: FakeDiscord, fg: FakeGuild, args: argparse.Namespace) -> list[str]:
+    def confsetup_interaction():
+        role = fg.guild.get_role(int(fg.players_role))
+        return fg.interaction(
+            fg.host_id,
+            "confsetup",
+            [
+                {"name": "role", "type": 8, "value": fg.players_role},
+                {"name": "conf_category", "type": 7, "value": fg.category_conf},
+                {"name": "submissions_category", "type": 7, "value": fg.category_subs},
+            ],
+            {
+                "roles": {fg.players_role: FakeGuild.role_payload(fg.players_role, role.name)},
+                "channels": {
+                    fg.category_conf: {"id": fg.category_conf, "type": 4, "name": "confessionals", "permissions": "8"},
+                    fg.category_subs: {"id": fg.category_subs, "type": 4, "name": "submissions", "permissions": "8"},
+                }
+            }
+        )
+
+    def private_channels() -> int:
+        return len(fg.guild.channels) - len(fg.guild.categories) - 2  # shop + chat
+
+    lines = []
+    for attempt in ("first run", "rerun"):
+        fake.reset_counts()
+        before = private_channels()
+        start = time.perf_counter()
+        await gcbot.bot.tree._call(confsetup_interaction())
+        elapsed = time.perf_counter() - start
+
+        created = private_channels() - before
+        total = sum(fake.calls.values())
+        lines.append(
+            f"confsetup ({attempt}): cast of {len(fg.cast_ids)}, {elapsed:.2f}s, "
+            f"{created} channel(s) created, {total} REST calls, 429s injected: {fake.rate_limited}"
+        )
+        lines += route_report(fake)
+
+    conf = fg.guild.get_channel(int(fg.category_conf))
+    names = [ch.name for ch in conf.text_channels]
+    if len(names) != len(fg.cast_ids) or len(set(names)) != len(names):
+        lines.append(f"  FAILED: {len(names)} confessionals for {len(fg.cast_ids)} players, {len(set(names))} unique names")
+    else:
+        lines.append("  OK")
+    return lines
+
+
+# ---------------------------
+# MAIN
+# ---------------------------
+
+async def run(args: argparse.Namespace) -> list[str]:
+    rng = random.Random(args.seed)
+    fake = FakeDiscord(args.rate_limit, rng)
+
+    runner = web.AppRunner(fake.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    discord.http.Route.BASE = f"http://127.0.0.1:{port}/api/v10"
+
+    bot = gcbot.bot
+    fake.state = bot._connection
+    try:
+        await bot.login("load-test-token")
+        fg = FakeGuild(fake, bot._connection, args.cast, args.buyers, args.lurkers)
+        gcbot.kaufhaus_store.data["channel_id"] = int(fg.shop_channel)
+
+        report = []
+        report += await scenario_buy_rush(fake, fg, args)
+        report += await scenario_wallets(fake, fg, args)
+        report += await scenario_confsetup(fake, fg, args)
+        report += ["", "bot's own /stats:", gcbot.metrics.format_summary()]
+        return report
+    finally:
+        watcher = getattr(bot, "shop_watcher", None)
+        if watcher is not None:
+            watcher.cancel()
+        await bot.close()
+        await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buyers", type=int, default=50, help="concurrent !buy senders")
+    parser.add_argument("--stock", type=int, default=10, help="stock of the contested item")
+    parser.add_argument("--wallets", type=int, default=50, help="concurrent /wallet checks")
+    parser.add_argument("--cast", type=int, default=40, help="members of the players role for /confsetup")
+    parser.add_argument("--lurkers", type=int, default=2000, help="members of the guild who aren't playing")
+    parser.add_argument("--rate-limit", type=float, default=0.05, help="share of requests answered with 429 first")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="also write the report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="gcbot-load-") as tmp:
+        for path in (gcbot.KAUFHAUS_FILE, gcbot.SCHWARTZ_FILE, gcbot.PLAYERS_FILE):
+            with open(path, "r", encoding="utf-8") as src, open(os.path.join(tmp, path), "w", encoding="utf-8") as dst:
+                dst.write(src.read())
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            report = asyncio.run(run(args))
+        finally:
+            os.chdir(cwd)
+
+    text = "\n".join(report)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 1 if "FAILED" in text else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())